@@ -0,0 +1,205 @@
+"""Batch position analysis: FEN or EPD lines in, one JSON object per line out.
+
+Positions are read lazily from a file or stdin, evaluated in batches by a
+pool of worker processes and written in input order. Only a bounded number
+of batches is in flight at once, so memory stays flat however long the
+input is, and a slow writer holds the reader back.
+
+    python analyze.py positions.epd --depth 4 --output results.jsonl
+    cat positions.fen | python analyze.py --nodes 20000 > results.jsonl
+
+Every output object carries the input line number. With --resume, lines
+already present in the output file are skipped and new results are
+appended, so an interrupted run carries on where it stopped.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_core import Board, move_to_uci
+from engine import MATE_SCORE, Engine, is_mate_score
+
+_worker = {}  # Engine of the current worker process, set up by _init_worker
+
+
+def parse_line(line):
+    """Split a FEN or EPD line into (fen, operations).
+
+    A FEN keeps its move clocks. An EPD has four position fields followed by
+    'opcode operand;' operations, returned as a dict of strings.
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"Not a FEN or EPD position: {line.strip()}")
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split()
+    if len(clocks) in (1, 2) and all(clock.isdigit() for clock in clocks):
+        return ' '.join(fields[:4] + clocks), {}
+
+    operations = {}
+    for operation in rest.split(';'):
+        opcode, _, operand = operation.strip().partition(' ')
+        if opcode:
+            operations[opcode] = operand.strip().strip('"')
+    return ' '.join(fields[:4]), operations
+
+
+def read_positions(lines, start_line=1):
+    """Yield (line_number, text) for every non-empty, non-comment line from `start_line` on."""
+    for number, line in enumerate(lines, start=1):
+        if number < start_line:
+            continue
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield number, line
+
+
+def batched(items, size):
+    """Yield lists of up to `size` consecutive items."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def analyze_position(engine, number, line):
+    """Return the result dict for one input line; bad lines get an 'error' field.
+
+    Never raises, so one broken position cannot stop a batch.
+    """
+    result = {'line': number}
+    try:
+        fen, operations = parse_line(line)
+        board = Board(fen)
+        if 'id' in operations:
+            result['id'] = operations['id']
+        result['fen'] = board.get_fen()
+        moves = board.generate_legal_moves()
+        result['legal_moves'] = len(moves)
+        result['status'] = board.game_status()
+        if moves and engine is not None:
+            search = engine.search(board)
+            result['best_move'] = move_to_uci(search.move)
+            if is_mate_score(search.score):
+                moves_to_mate = (MATE_SCORE - abs(search.score) + 1) // 2
+                result['mate'] = moves_to_mate if search.score > 0 else -moves_to_mate
+            else:
+                result['score'] = search.score
+            result['depth'] = search.depth
+            result['nodes'] = search.nodes
+    except Exception as error:  # Report the position and carry on with the rest
+        return {'line': number, 'error': str(error) or type(error).__name__}
+    return result
+
+
+def _init_worker(depth, nodes, movetime, hash_mb):
+    engine = None
+    if depth:
+        engine = Engine(max_depth=depth, max_nodes=nodes, max_time=movetime, hash_mb=hash_mb)
+    _worker['engine'] = engine
+
+
+def _analyze_batch(batch):
+    engine = _worker['engine']
+    return [analyze_position(engine, number, line) for number, line in batch]
+
+
+def analyze_stream(positions, workers=None, batch_size=32, max_pending=None, engine_options=(4, None, None, 16)):
+    """Yield result dicts for (line_number, text) pairs, in input order.
+
+    `engine_options` is (depth, nodes, movetime, hash_mb); depth 0 skips the
+    search. At most `max_pending` batches (default: twice the number of
+    workers) are queued in the pool at any time.
+    """
+    batches = batched(positions, batch_size)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(*engine_options)
+        for batch in batches:
+            yield from _analyze_batch(batch)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=engine_options) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_analyze_batch, batch))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def resume_point(path):
+    """Return (last input line done, byte length of the complete results) for an output file.
+
+    Anything after the last complete result, such as a line cut short by
+    an interrupted run, is not counted.
+    """
+    last, length = 0, 0
+    try:
+        with open(path, 'rb') as results:
+            for line in results:
+                try:
+                    number = json.loads(line)['line']
+                except (ValueError, KeyError):
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                last, length = number, length + len(line)
+    except FileNotFoundError:
+        pass
+    return last, length
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze FEN or EPD positions and write JSON lines.")
+    parser.add_argument('input', nargs='?', help="file with one position per line (default: stdin)")
+    parser.add_argument('--output', help="file to write results to (default: stdout)")
+    parser.add_argument('--resume', action='store_true', help="skip positions already in --output and append")
+    parser.add_argument('--depth', type=int, default=4, help="search depth in plies, 0 for no search")
+    parser.add_argument('--nodes', type=int, help="node limit per position")
+    parser.add_argument('--movetime', type=float, help="time limit per position in seconds")
+    parser.add_argument('--hash', type=int, default=16, help="transposition table size per worker in MB")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--batch', type=int, default=32, help="positions sent to a worker at a time")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+
+    start_line = 1
+    if args.resume:
+        last, length = resume_point(args.output)
+        start_line = last + 1
+        if os.path.exists(args.output):
+            os.truncate(args.output, length)
+    source = open(args.input, encoding='utf-8') if args.input else sys.stdin
+    sink = open(args.output, 'a' if args.resume else 'w', encoding='utf-8') if args.output else sys.stdout
+
+    count = 0
+    start = time.perf_counter()
+    try:
+        results = analyze_stream(read_positions(source, start_line), args.workers, args.batch,
+                                 engine_options=(args.depth, args.nodes, args.movetime, args.hash))
+        for result in results:
+            sink.write(json.dumps(result) + '\n')
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    seconds = time.perf_counter() - start
+    print(f"{count} positions in {seconds:.2f}s ({count / seconds if seconds else 0:,.1f}/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
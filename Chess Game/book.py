@@ -0,0 +1,156 @@
+"""Opening book: a sorted file of (position key, move, weight) entries read through mmap.
+
+The layout follows the Polyglot book format: 16-byte big-endian entries
+of key (8 bytes), move (2), weight (2) and learn data (4), sorted by key.
+Keys are Board.zobrist_key() and moves are packed with encode_move, so
+the files are not interchangeable with Polyglot's own keys and moves.
+Nothing is parsed when a book is opened; a lookup is a binary search over
+the mapped file.
+
+Build a book from games and look up a position:
+    python book.py build games.pgn --output book.bin --plies 16
+    python book.py probe --fen "<fen>" --book book.bin
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+from collections import defaultdict
+
+from chess_core import START_FEN, Board, decode_move, encode_move, move_to_uci
+from pgn import PGNError, parse_san, read_games, start_board
+
+ENTRY = struct.Struct('>QHHI')
+_KEY = struct.Struct('>Q')
+# Points a move earns for the side that played it, as in Polyglot books
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}
+
+
+class OpeningBook:
+    """Read-only view of a book file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as book_file:
+            size = os.fstat(book_file.fileno()).st_size
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.size = len(self._map) // ENTRY.size
+
+    def _lower_bound(self, key):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if _KEY.unpack_from(self._map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries(self, key):
+        """Return the (move_code, weight) pairs stored for a position key."""
+        found = []
+        index = self._lower_bound(key)
+        while index < self.size:
+            entry_key, move_code, weight, _ = ENTRY.unpack_from(self._map, index * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((move_code, weight))
+            index += 1
+        return found
+
+    def moves(self, board):
+        """Return the book's legal moves for `board` as (move, weight), heaviest first."""
+        legal = board.generate_legal_moves()
+        moves = [(decode_move(code), weight) for code, weight in self.entries(board.zobrist_key())]
+        return sorted([(move, weight) for move, weight in moves if move in legal and weight],
+                      key=lambda item: -item[1])
+
+    def choose(self, board, rng=random):
+        """Pick a book move for `board` at random by weight, or return None."""
+        moves = self.moves(board)
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_book(games, max_plies=16, min_games=1):
+    """Return sorted book entries (key, move_code, weight) from an iterable of pgn Games.
+
+    Only the first `max_plies` moves of each game count, and a move must be
+    played in at least `min_games` games to be kept. Weights are scaled to
+    fit 16 bits.
+    """
+    points = defaultdict(int)
+    counts = defaultdict(int)
+    for game in games:
+        white_points, black_points = RESULT_POINTS.get(game.result, (0, 0))
+        try:
+            board = start_board(game.headers)
+            for san in game.moves[:max_plies]:
+                move = parse_san(board, san)
+                key = (board.zobrist_key(), encode_move(move))
+                points[key] += white_points if board.turn == 'w' else black_points
+                counts[key] += 1
+                board.make_move(*move)
+        except (PGNError, ValueError):
+            continue  # The moves before the bad one still count
+    kept = {key: weight for key, weight in points.items() if counts[key] >= min_games}
+    scale = max(1, -(-max(kept.values(), default=0) // 0xFFFF))
+    return sorted((key, move, max(1, weight // scale) if weight else 0) for (key, move), weight in kept.items())
+
+
+def write_book(entries, path):
+    with open(path, 'wb') as book_file:
+        for key, move_code, weight in entries:
+            book_file.write(ENTRY.pack(key, move_code, weight, 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build a book from PGN files")
+    build.add_argument('files', nargs='+', help="PGN files to read")
+    build.add_argument('--output', default='book.bin', help="book file to write")
+    build.add_argument('--plies', type=int, default=16, help="moves per game to include")
+    build.add_argument('--min-games', type=int, default=1, help="games a move must appear in")
+    probe = commands.add_parser('probe', help="list the book moves of a position")
+    probe.add_argument('--book', default='book.bin', help="book file to read")
+    probe.add_argument('--fen', default=START_FEN, help="position to look up (default: start position)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        def games():
+            for path in args.files:
+                with open(path, encoding='utf-8', errors='replace') as pgn_file:
+                    yield from read_games(pgn_file)
+        entries = build_book(games(), args.plies, args.min_games)
+        write_book(entries, args.output)
+        print(f"{len(entries)} entries written to {args.output}")
+        return 0
+
+    with OpeningBook(args.book) as book:
+        board = Board(args.fen)
+        moves = book.moves(board)
+        total = sum(weight for _, weight in moves)
+        for move, weight in moves:
+            print(f"{move_to_uci(move)} {weight} ({weight / total:.1%})")
+        if not moves:
+            print("Position not in book.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,921 @@
+"""Chess rules without any user interface: pieces, board, move generation and FEN.
+
+Nothing here imports pygame or touches a display, so the rules load quickly
+in engine workers, command-line tools and servers. The pygame game in
+chess_game.py draws on top of this module.
+"""
+import os
+import random
+from array import array
+
+ROWS, COLS = 8, 8
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+class Piece:
+    """A piece on the board. Moves come from Board.generate_legal_moves."""
+
+    def __init__(self, color, name):
+        self.color = color
+        self.name = name
+        self.position = None
+        self.has_moved = False
+
+    def get_valid_moves(self, position, board):
+        """Return the squares this piece on `position` can legally move to."""
+        targets = []
+        for from_pos, to_pos, _ in board.generate_legal_moves(self.color):
+            if from_pos == position and to_pos not in targets:
+                targets.append(to_pos)
+        return targets
+
+class Pawn(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'P' if color == 'w' else 'p')
+
+class Rook(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'R' if color == 'w' else 'r')
+
+class Knight(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'N' if color == 'w' else 'n')
+
+class Bishop(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'B' if color == 'w' else 'b')
+
+class Queen(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'Q' if color == 'w' else 'q')
+
+class King(Piece):
+    def __init__(self, color):
+        super().__init__(color, 'K' if color == 'w' else 'k')
+
+PIECE_CLASSES = {'p': Pawn, 'n': Knight, 'b': Bishop, 'r': Rook, 'q': Queen, 'k': King}
+
+def create_piece(name):
+    """Create a piece from its FEN letter ('P', 'n', ...)."""
+    color = 'w' if name.isupper() else 'b'
+    return PIECE_CLASSES[name.lower()](color)
+
+def square_index(row, col):
+    """Map a (row, col) board coordinate to a 0-63 bitboard square."""
+    return row * COLS + col
+
+def square_name(position):
+    """Return the algebraic name ('e4') of a (row, col) coordinate."""
+    row, col = position
+    return 'abcdefgh'[col] + str(ROWS - row)
+
+def parse_square(name):
+    """Return the (row, col) coordinate of an algebraic square name ('e4')."""
+    if len(name) != 2 or name[0] not in 'abcdefgh' or name[1] not in '12345678':
+        raise ValueError(f"Invalid square: {name}")
+    return ROWS - int(name[1]), 'abcdefgh'.index(name[0])
+
+def move_to_uci(move):
+    """Return the UCI notation ('e2e4', 'e7e8q') of a (from_pos, to_pos, promotion) move."""
+    from_pos, to_pos, promotion = move
+    return square_name(from_pos) + square_name(to_pos) + (promotion or '')
+
+def parse_uci(text):
+    """Return the (from_pos, to_pos, promotion) move written in UCI notation ('e7e8q')."""
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] not in 'qrbn'):
+        raise ValueError(f"Invalid UCI move: {text}")
+    return parse_square(text[:2]), parse_square(text[2:4]), text[4:] or None
+
+# Moves pack into 16 bits: from square in bits 0-5, to square in 6-11, the
+# promotion piece in 12-13 and the kind of move in 14-15.
+MOVE_NORMAL, MOVE_PROMOTION, MOVE_EN_PASSANT, MOVE_CASTLING = 0, 1, 2, 3
+PROMOTION_CODES = {'n': 0, 'b': 1, 'r': 2, 'q': 3}
+
+def encode_move(move, kind=MOVE_NORMAL):
+    """Pack a (from_pos, to_pos, promotion) move into a 16-bit int; 0 means no move.
+
+    A promotion is always marked as such; en passant and castling are only
+    marked when `kind` says so, since the tuple alone does not tell.
+    """
+    (fr, fc), (tr, tc), promotion = move
+    code = (fr * COLS + fc) | ((tr * COLS + tc) << 6)
+    if promotion:
+        return code | (PROMOTION_CODES[promotion] << 12) | (MOVE_PROMOTION << 14)
+    return code | (kind << 14)
+
+def decode_move(code):
+    """Unpack a move packed by encode_move into a (from_pos, to_pos, promotion) tuple."""
+    promotion = 'nbrq'[(code >> 12) & 3] if code >> 14 == MOVE_PROMOTION else None
+    return divmod(code & 63, COLS), divmod((code >> 6) & 63, COLS), promotion
+
+def square_position(square):
+    """Map a 0-63 bitboard square back to its (row, col) coordinate."""
+    return divmod(square, COLS)
+
+def iter_squares(bitboard):
+    """Yield the square index of every set bit in a bitboard."""
+    while bitboard:
+        lsb = bitboard & -bitboard
+        yield lsb.bit_length() - 1
+        bitboard ^= lsb
+
+KNIGHT_STEPS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_STEPS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+def _step_table(steps):
+    """Precompute, for every square, the mask of squares one step away."""
+    table = []
+    for square in range(ROWS * COLS):
+        row, col = divmod(square, COLS)
+        mask = 0
+        for dr, dc in steps:
+            r, c = row + dr, col + dc
+            if 0 <= r < ROWS and 0 <= c < COLS:
+                mask |= 1 << (r * COLS + c)
+        table.append(mask)
+    return table
+
+def _ray_table(direction):
+    """Precompute, for every square, the mask of the open ray in one direction."""
+    dr, dc = direction
+    table = []
+    for square in range(ROWS * COLS):
+        row, col = divmod(square, COLS)
+        mask = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < ROWS and 0 <= c < COLS:
+            mask |= 1 << (r * COLS + c)
+            r += dr
+            c += dc
+        table.append(mask)
+    return table
+
+KNIGHT_ATTACKS = _step_table(KNIGHT_STEPS)
+KING_ATTACKS = _step_table(KING_STEPS)
+PAWN_ATTACKS = {'w': _step_table([(-1, -1), (-1, 1)]), 'b': _step_table([(1, -1), (1, 1)])}
+RAYS = {direction: _ray_table(direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+FULL_BOARD = (1 << (ROWS * COLS)) - 1
+BACK_RANKS = ((1 << COLS) - 1) | (((1 << COLS) - 1) << (ROWS - 1) * COLS)  # Ranks 8 and 1
+SQUARE_POSITIONS = [divmod(square, COLS) for square in range(ROWS * COLS)]
+PROMOTION_CHOICES = ('q', 'r', 'b', 'n')
+# Castling rights lost when a move starts or ends on one of these squares
+CASTLING_SQUARES = {(7, 4): 'KQ', (7, 7): 'K', (7, 0): 'Q', (0, 4): 'kq', (0, 7): 'k', (0, 0): 'q'}
+ROOK_LINES = [0] * (ROWS * COLS)
+BISHOP_LINES = [0] * (ROWS * COLS)
+# BETWEEN[a][b] holds the squares strictly between two aligned squares, else 0.
+BETWEEN = [[0] * (ROWS * COLS) for _ in range(ROWS * COLS)]
+for _direction, _rays in RAYS.items():
+    _lines = ROOK_LINES if _direction in ROOK_DIRECTIONS else BISHOP_LINES
+    for _square in range(ROWS * COLS):
+        _lines[_square] |= _rays[_square]
+        for _target in iter_squares(_rays[_square]):
+            BETWEEN[_square][_target] = _rays[_square] ^ _rays[_target] ^ (1 << _target)
+# Rays that run towards higher square indices find their first blocker at the
+# lowest set bit, the others at the highest set bit.
+_ROOK_RAYS = [(RAYS[d], d[0] * COLS + d[1] > 0) for d in ROOK_DIRECTIONS]
+_BISHOP_RAYS = [(RAYS[d], d[0] * COLS + d[1] > 0) for d in BISHOP_DIRECTIONS]
+
+def _slide(square, rays, occupancy):
+    attacks = 0
+    for table, ascending in rays:
+        ray = table[square]
+        blockers = ray & occupancy
+        if blockers:
+            if ascending:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+def rook_attacks(square, occupancy):
+    """Squares a rook on `square` attacks given the occupancy mask."""
+    return _slide(square, _ROOK_RAYS, occupancy)
+
+def bishop_attacks(square, occupancy):
+    """Squares a bishop on `square` attacks given the occupancy mask."""
+    return _slide(square, _BISHOP_RAYS, occupancy)
+
+def queen_attacks(square, occupancy):
+    """Squares a queen on `square` attacks given the occupancy mask."""
+    return _slide(square, _ROOK_RAYS, occupancy) | _slide(square, _BISHOP_RAYS, occupancy)
+
+def piece_attacks(name, square, occupancy):
+    """Squares attacked by the piece `name` ('P', 'n', ...) standing on `square`."""
+    kind = name.lower()
+    if kind == 'p':
+        return PAWN_ATTACKS['w' if name == 'P' else 'b'][square]
+    if kind == 'n':
+        return KNIGHT_ATTACKS[square]
+    if kind == 'k':
+        return KING_ATTACKS[square]
+    if kind == 'b':
+        return bishop_attacks(square, occupancy)
+    if kind == 'r':
+        return rook_attacks(square, occupancy)
+    return queen_attacks(square, occupancy)
+
+# Zobrist keys. The generator is seeded so keys are identical in every
+# process, which lets worker processes and files on disk share them.
+_zobrist_random = random.Random(0x5A0B1257)
+ZOBRIST_PIECES = {name: [_zobrist_random.getrandbits(64) for _ in range(ROWS * COLS)]
+                  for name in 'PNBRQKpnbrqk'}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = {right: _zobrist_random.getrandbits(64) for right in 'KQkq'}
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(COLS)]
+
+# Undo records pack into one 64-bit word: the move code in bits 0-15, the
+# captured piece in 16-19, castling rights in 20-23, the en passant file in
+# 24-27, whether the moved, captured and castling rook pieces had moved
+# before in bits 28-30, and the halfmove clock from bit 32.
+PIECE_LETTERS = 'PNBRQKpnbrqk'
+CASTLING_BITS = {'K': 1, 'Q': 2, 'k': 4, 'q': 8}
+CASTLING_STRINGS = [''.join(right for right in 'KQkq' if mask & CASTLING_BITS[right]) for mask in range(16)]
+
+# Evaluation: material plus piece-square bonuses, with separate middlegame
+# and endgame values blended by game phase. Tables are from White's side
+# with a8 first, the same order as the squares; Black reads them mirrored.
+MATERIAL_VALUES = {'P': (82, 94), 'N': (337, 281), 'B': (365, 297), 'R': (477, 512), 'Q': (1025, 936), 'K': (0, 0)}
+_KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+_BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+_ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0)
+_QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+PIECE_SQUARE_TABLES = {
+    'P': ((  0,   0,   0,   0,   0,   0,   0,   0,
+            50,  50,  50,  50,  50,  50,  50,  50,
+            10,  10,  20,  30,  30,  20,  10,  10,
+             5,   5,  10,  25,  25,  10,   5,   5,
+             0,   0,   0,  20,  20,   0,   0,   0,
+             5,  -5, -10,   0,   0, -10,  -5,   5,
+             5,  10,  10, -20, -20,  10,  10,   5,
+             0,   0,   0,   0,   0,   0,   0,   0),
+          (  0,   0,   0,   0,   0,   0,   0,   0,
+            80,  80,  80,  80,  80,  80,  80,  80,
+            50,  50,  50,  50,  50,  50,  50,  50,
+            30,  30,  30,  30,  30,  30,  30,  30,
+            15,  15,  15,  15,  15,  15,  15,  15,
+             5,   5,   5,   5,   5,   5,   5,   5,
+             0,   0,   0,   0,   0,   0,   0,   0,
+             0,   0,   0,   0,   0,   0,   0,   0)),
+    'N': (_KNIGHT_TABLE, _KNIGHT_TABLE),
+    'B': (_BISHOP_TABLE, _BISHOP_TABLE),
+    'R': (_ROOK_TABLE, _ROOK_TABLE),
+    'Q': (_QUEEN_TABLE, _QUEEN_TABLE),
+    'K': ((-30, -40, -40, -50, -50, -40, -40, -30,
+           -30, -40, -40, -50, -50, -40, -40, -30,
+           -30, -40, -40, -50, -50, -40, -40, -30,
+           -30, -40, -40, -50, -50, -40, -40, -30,
+           -20, -30, -30, -40, -40, -30, -30, -20,
+           -10, -20, -20, -20, -20, -20, -20, -10,
+            20,  20,   0,   0,   0,   0,  20,  20,
+            20,  30,  10,   0,   0,  10,  30,  20),
+          (-50, -40, -30, -20, -20, -30, -40, -50,
+           -30, -20, -10,   0,   0, -10, -20, -30,
+           -30, -10,  20,  30,  30,  20, -10, -30,
+           -30, -10,  30,  40,  40,  30, -10, -30,
+           -30, -10,  30,  40,  40,  30, -10, -30,
+           -30, -10,  20,  30,  30,  20, -10, -30,
+           -30, -30,   0,   0,   0,   0, -30, -30,
+           -50, -30, -30, -30, -30, -30, -30, -50)),
+}
+# Weight of each piece in the game phase; 24 with all pieces on the board
+PHASE_WEIGHTS = {'P': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0, 'p': 0, 'n': 1, 'b': 1, 'r': 2, 'q': 4, 'k': 0}
+MAX_PHASE = 24
+# Signed material plus bonus of a piece on each square, White positive
+EVAL_MIDDLEGAME = {}
+EVAL_ENDGAME = {}
+for _letter, (_middlegame, _endgame) in PIECE_SQUARE_TABLES.items():
+    _value_mg, _value_eg = MATERIAL_VALUES[_letter]
+    EVAL_MIDDLEGAME[_letter] = [_value_mg + _middlegame[square] for square in range(ROWS * COLS)]
+    EVAL_ENDGAME[_letter] = [_value_eg + _endgame[square] for square in range(ROWS * COLS)]
+    EVAL_MIDDLEGAME[_letter.lower()] = [-_value_mg - _middlegame[square ^ 56] for square in range(ROWS * COLS)]
+    EVAL_ENDGAME[_letter.lower()] = [-_value_eg - _endgame[square ^ 56] for square in range(ROWS * COLS)]
+# Set CHESS_CHECK_EVAL=1 to compare the incremental evaluation with a full
+# recount on every Board.evaluate() call
+CHECK_EVALUATION = bool(os.environ.get('CHESS_CHECK_EVAL'))
+
+class Position:
+    """Bitboard representation of the pieces on the board.
+
+    Squares are numbered row * 8 + col to match Board.board, so bit 0 is a8
+    and bit 63 is h1. There is one 64-bit mask per piece name ('P', 'n', ...),
+    one occupancy mask per color and one for all pieces.
+
+    Each occupied square also carries the mask of squares its piece attacks.
+    These are maintained incrementally: a change on one square only refreshes
+    that square and the sliders whose rays touch it. The per-color attack maps
+    are the union of those masks and are cached until the next change.
+
+    `key` is the Zobrist hash of the piece placement, and `middlegame`,
+    `endgame` and `phase` the evaluation terms; all are updated on every
+    put and remove.
+    """
+    PIECE_NAMES = 'PNBRQKpnbrqk'
+
+    def __init__(self):
+        self.pieces = {name: 0 for name in self.PIECE_NAMES}
+        self.occupied = {'w': 0, 'b': 0}
+        self.occupancy = 0
+        self.squares = [None] * (ROWS * COLS)
+        self.attacks_from = [0] * (ROWS * COLS)
+        self.sliders = 0
+        self.key = 0
+        self.middlegame = 0
+        self.endgame = 0
+        self.phase = 0
+        self._attack_maps = {'w': None, 'b': None}
+
+    def put(self, square, name):
+        bit = 1 << square
+        self.pieces[name] |= bit
+        self.occupied['w' if name.isupper() else 'b'] |= bit
+        self.occupancy |= bit
+        self.squares[square] = name
+        self.key ^= ZOBRIST_PIECES[name][square]
+        self.middlegame += EVAL_MIDDLEGAME[name][square]
+        self.endgame += EVAL_ENDGAME[name][square]
+        self.phase += PHASE_WEIGHTS[name]
+        if name in 'BRQbrq':
+            self.sliders |= bit
+        self._refresh_attacks(square)
+
+    def remove(self, square, name):
+        mask = ~(1 << square)
+        self.pieces[name] &= mask
+        self.occupied['w' if name.isupper() else 'b'] &= mask
+        self.occupancy &= mask
+        self.squares[square] = None
+        self.key ^= ZOBRIST_PIECES[name][square]
+        self.middlegame -= EVAL_MIDDLEGAME[name][square]
+        self.endgame -= EVAL_ENDGAME[name][square]
+        self.phase -= PHASE_WEIGHTS[name]
+        self.sliders &= mask
+        self._refresh_attacks(square)
+
+    def _refresh_attacks(self, square):
+        """Update the attack masks affected by a change on `square`."""
+        bit = 1 << square
+        occupancy = self.occupancy
+        attacks_from = self.attacks_from
+        name = self.squares[square]
+        attacks_from[square] = piece_attacks(name, square, occupancy) if name else 0
+        # A slider's attacks always include its first blocker, so the sliders
+        # affected by this square are exactly the ones already attacking it.
+        for slider in iter_squares(self.sliders & ~bit):
+            if attacks_from[slider] & bit:
+                attacks_from[slider] = piece_attacks(self.squares[slider], slider, occupancy)
+        self._attack_maps['w'] = self._attack_maps['b'] = None
+
+    def evaluation_terms(self):
+        """Recount (middlegame, endgame, phase) from the squares, for checking the running values."""
+        middlegame = endgame = phase = 0
+        for square, name in enumerate(self.squares):
+            if name is not None:
+                middlegame += EVAL_MIDDLEGAME[name][square]
+                endgame += EVAL_ENDGAME[name][square]
+                phase += PHASE_WEIGHTS[name]
+        return middlegame, endgame, phase
+
+    def attack_map(self, color):
+        """Return the mask of every square attacked by `color`."""
+        attack_map = self._attack_maps[color]
+        if attack_map is None:
+            attack_map = 0
+            attacks_from = self.attacks_from
+            for square in iter_squares(self.occupied[color]):
+                attack_map |= attacks_from[square]
+            self._attack_maps[color] = attack_map
+        return attack_map
+
+    def attackers_to(self, square, color, occupancy=None):
+        """Return the mask of `color` pieces attacking `square`."""
+        if occupancy is None:
+            occupancy = self.occupancy
+        pieces = self.pieces
+        if color == 'w':
+            pawn, knight, bishop, rook, queen, king = 'PNBRQK'
+            pawn_attacks = PAWN_ATTACKS['b']
+        else:
+            pawn, knight, bishop, rook, queen, king = 'pnbrqk'
+            pawn_attacks = PAWN_ATTACKS['w']
+        return ((pawn_attacks[square] & pieces[pawn])
+                | (KNIGHT_ATTACKS[square] & pieces[knight])
+                | (KING_ATTACKS[square] & pieces[king])
+                | (bishop_attacks(square, occupancy) & (pieces[bishop] | pieces[queen]))
+                | (rook_attacks(square, occupancy) & (pieces[rook] | pieces[queen])))
+
+    def is_attacked(self, square, by_color):
+        return (self.attack_map(by_color) >> square) & 1 == 1
+
+    def is_empty(self, square):
+        return not (self.occupancy >> square) & 1
+
+    def is_color(self, square, color):
+        return (self.occupied[color] >> square) & 1 == 1
+
+    def king_square(self, color):
+        """Return the square of the king of the given color, or None."""
+        king = self.pieces['K' if color == 'w' else 'k']
+        return (king & -king).bit_length() - 1 if king else None
+
+class Board:
+    def __init__(self, fen=None):
+        self.board = []
+        self.position = Position()
+        if fen is None:
+            self.create_board()
+        else:
+            self.set_fen(fen)
+
+    def create_board(self):
+        """Set up the standard starting position."""
+        self.set_fen(START_FEN)
+
+    def set_fen(self, fen):
+        """Set up the board from a FEN string, replacing the current game."""
+        fields = fen.split()
+        if not fields:
+            raise ValueError("Empty FEN string")
+        ranks = fields[0].split('/')
+        if len(ranks) != ROWS:
+            raise ValueError(f"Invalid FEN piece placement: {fields[0]}")
+
+        self.board = [[None for _ in range(COLS)] for _ in range(ROWS)]
+        self.position = Position()
+        for row, rank in enumerate(ranks):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                elif char.lower() in PIECE_CLASSES and col < COLS:
+                    self.set_piece((row, col), create_piece(char))
+                    col += 1
+                else:
+                    raise ValueError(f"Invalid FEN rank: {rank}")
+            if col != COLS:
+                raise ValueError(f"Invalid FEN rank: {rank}")
+        # Move generation relies on every pawn having a square ahead and on one king per side
+        pieces = self.position.pieces
+        if (pieces['P'] | pieces['p']) & BACK_RANKS:
+            raise ValueError(f"Invalid FEN: pawn on the first or last rank: {fields[0]}")
+        for king in 'Kk':
+            if bin(pieces[king]).count('1') != 1:
+                raise ValueError(f"Invalid FEN: need exactly one {king} in {fields[0]}")
+
+        self.turn = fields[1] if len(fields) > 1 else 'w'
+        if self.turn not in ('w', 'b'):
+            raise ValueError(f"Invalid FEN active color: {self.turn}")
+        rights = fields[2] if len(fields) > 2 and fields[2] != '-' else ''
+        if any(right not in CASTLING_BITS for right in rights):
+            raise ValueError(f"Invalid FEN castling rights: {rights}")
+        self.castling = ''.join(right for right in 'KQkq' if right in rights)
+        self.en_passant = parse_square(fields[3]) if len(fields) > 3 and fields[3] != '-' else None
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        self.undo_stack = array('Q')  # One packed undo record per move
+        self.key_history = array('Q')  # Zobrist keys of the positions before each move
+
+        # Kings and rooks without castling rights count as having moved
+        for row, col, right in ((7, 4, 'KQ'), (0, 4, 'kq'), (7, 7, 'K'), (7, 0, 'Q'), (0, 7, 'k'), (0, 0, 'q')):
+            piece = self.board[row][col]
+            if isinstance(piece, (King, Rook)) and not any(r in self.castling for r in right):
+                piece.has_moved = True
+
+    def move_piece(self, from_pos, to_pos):
+        fr, fc = from_pos
+        tr, tc = to_pos
+        piece = self.board[fr][fc]
+
+        # Move the piece
+        self.set_piece(to_pos, piece)
+        self.set_piece(from_pos, None)
+        piece.has_moved = True
+
+        # Handle Castling
+        if isinstance(piece, King):
+            if tc - fc == 2:
+                self.move_rook((fr, 7), (fr, 5))
+            elif tc - fc == -2:
+                self.move_rook((fr, 0), (fr, 3))
+
+        # Check for pawn promotion
+        promotion = False
+        if isinstance(piece, Pawn):
+            if (piece.color == 'w' and tr == 0) or (piece.color == 'b' and tr == 7):
+                promotion = True
+
+        return promotion, (tr, tc) if promotion else None
+
+    def move_rook(self, from_pos, to_pos):
+        fr, fc = from_pos
+        rook = self.board[fr][fc]
+
+        if rook is not None and isinstance(rook, Rook):
+            self.set_piece(to_pos, rook)
+            self.set_piece(from_pos, None)
+            rook.has_moved = True
+
+    def make_move(self, from_pos, to_pos, promotion=None):
+        """Play a move for the side to move and remember how to take it back.
+
+        Handles castling, en passant and promotion; `promotion` is the piece
+        letter ('q', 'r', 'b' or 'n') a pawn reaching the last rank becomes,
+        defaulting to a queen. Returns the move packed with encode_move,
+        marked with its kind.
+        """
+        fr, fc = from_pos
+        tr, tc = to_pos
+        piece = self.board[fr][fc]
+        captured_piece = self.board[tr][tc]
+        rook = None
+        kind = MOVE_NORMAL
+
+        if isinstance(piece, Pawn):
+            if to_pos == self.en_passant and fc != tc:
+                kind = MOVE_EN_PASSANT
+                captured_piece = self.board[fr][tc]
+                self.set_piece((fr, tc), None)
+            elif tr in (0, ROWS - 1):
+                kind = MOVE_PROMOTION
+                promotion = promotion or 'q'
+        elif isinstance(piece, King) and abs(tc - fc) == 2:
+            kind = MOVE_CASTLING
+            rook = self.board[fr][7 if tc > fc else 0]
+
+        code = encode_move((from_pos, to_pos, promotion if kind == MOVE_PROMOTION else None), kind)
+        state = code | (min(self.halfmove_clock, 0xFFFF) << 32)
+        if captured_piece is not None:
+            state |= (PIECE_LETTERS.index(captured_piece.name) + 1) << 16
+            state |= captured_piece.has_moved << 29
+        for right in self.castling:
+            state |= CASTLING_BITS[right] << 20
+        if self.en_passant is not None:
+            state |= (self.en_passant[1] + 1) << 24
+        state |= piece.has_moved << 28
+        if rook is not None:
+            state |= rook.has_moved << 30
+        self.key_history.append(self.zobrist_key())
+        self.undo_stack.append(state)
+
+        self.move_piece(from_pos, to_pos)
+        if kind == MOVE_PROMOTION:
+            promoted = create_piece(promotion.upper() if piece.color == 'w' else promotion.lower())
+            promoted.has_moved = True
+            self.set_piece(to_pos, promoted)
+
+        if self.castling:
+            for square in (from_pos, to_pos):
+                lost = CASTLING_SQUARES.get(square)
+                if lost:
+                    self.castling = ''.join(right for right in self.castling if right not in lost)
+
+        if isinstance(piece, Pawn) and abs(tr - fr) == 2:
+            self.en_passant = ((fr + tr) // 2, fc)
+        else:
+            self.en_passant = None
+
+        if isinstance(piece, Pawn) or captured_piece is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece.color == 'b':
+            self.fullmove_number += 1
+        self.turn = 'b' if piece.color == 'w' else 'w'
+        return code
+
+    def unmake_move(self):
+        """Take back the last move played with make_move."""
+        state = self.undo_stack.pop()
+        self.key_history.pop()
+        from_square = state & 63
+        to_square = (state >> 6) & 63
+        kind = (state >> 14) & 3
+        from_pos = SQUARE_POSITIONS[from_square]
+        to_pos = SQUARE_POSITIONS[to_square]
+
+        piece = self.board[to_pos[0]][to_pos[1]]
+        if kind == MOVE_PROMOTION:
+            piece = create_piece('P' if piece.color == 'w' else 'p')
+        self.set_piece(to_pos, None)
+        self.set_piece(from_pos, piece)
+        piece.has_moved = bool(state >> 28 & 1)
+
+        captured = (state >> 16) & 15
+        if captured:
+            captured_piece = create_piece(PIECE_LETTERS[captured - 1])
+            captured_piece.has_moved = bool(state >> 29 & 1)
+            captured_pos = (from_pos[0], to_pos[1]) if kind == MOVE_EN_PASSANT else to_pos
+            self.set_piece(captured_pos, captured_piece)
+
+        if kind == MOVE_CASTLING:
+            row = from_pos[0]
+            short = to_pos[1] > from_pos[1]
+            rook = self.board[row][5 if short else 3]
+            self.set_piece((row, 5 if short else 3), None)
+            self.set_piece((row, 7 if short else 0), rook)
+            rook.has_moved = bool(state >> 30 & 1)
+
+        self.castling = CASTLING_STRINGS[(state >> 20) & 15]
+        en_passant_file = (state >> 24) & 15
+        # The side to move again faces the en passant square its opponent left
+        self.en_passant = (2 if piece.color == 'w' else 5, en_passant_file - 1) if en_passant_file else None
+        self.halfmove_clock = state >> 32
+        if piece.color == 'b':
+            self.fullmove_number -= 1
+        self.turn = piece.color
+
+    def zobrist_key(self):
+        """Return the 64-bit Zobrist key of the position.
+
+        The piece part is maintained incrementally by Position; side to move,
+        castling rights and a capturable en passant square are folded in here.
+        """
+        key = self.position.key
+        if self.turn == 'b':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        for right in self.castling:
+            key ^= ZOBRIST_CASTLING[right]
+        if self.en_passant is not None:
+            row, col = self.en_passant
+            pawns = self.position.pieces['P' if self.turn == 'w' else 'p']
+            if PAWN_ATTACKS['b' if self.turn == 'w' else 'w'][row * COLS + col] & pawns:
+                key ^= ZOBRIST_EN_PASSANT[col]
+        return key
+
+    def repetition_count(self):
+        """Return how many times the current position occurred before, since the last capture or pawn move."""
+        key = self.zobrist_key()
+        history = self.key_history
+        count = 0
+        # Only positions with the same side to move, within the halfmove clock, can repeat
+        for index in range(len(history) - 2, max(len(history) - self.halfmove_clock, 0) - 1, -2):
+            if history[index] == key:
+                count += 1
+        return count
+
+    def copy(self):
+        """Return an independent board in the same position, keeping the repetition history."""
+        board = Board(self.get_fen())
+        board.key_history = array('Q', self.key_history)
+        return board
+
+    def generate_legal_moves(self, color=None):
+        """Return every legal move as a (from_pos, to_pos, promotion) tuple.
+
+        Moves are filtered with pin and check masks rather than by playing
+        them: a pinned piece may only move along the line to its pinner, and
+        while in check the other pieces may only capture or block the
+        checker. Only en passant, which can uncover a check along the rank,
+        is verified on the board.
+        """
+        if color is None:
+            color = self.turn
+        enemy = 'b' if color == 'w' else 'w'
+        position = self.position
+        pieces = position.pieces
+        own = position.occupied[color]
+        occupancy = position.occupancy
+        king_square = position.king_square(color)
+        moves = []
+        if king_square is None:
+            return moves
+
+        # Squares the king may not step to. Sliders checking the king are
+        # recomputed with the king lifted off, so it cannot retreat along
+        # the checking line.
+        checkers = position.attackers_to(king_square, enemy)
+        danger = position.attack_map(enemy)
+        for square in iter_squares(checkers & position.sliders):
+            danger |= piece_attacks(position.squares[square], square, occupancy ^ (1 << king_square))
+
+        king_pos = SQUARE_POSITIONS[king_square]
+        for target in iter_squares(KING_ATTACKS[king_square] & ~own & ~danger):
+            moves.append((king_pos, SQUARE_POSITIONS[target], None))
+
+        if checkers & (checkers - 1):
+            return moves  # Double check: only the king can move
+        if checkers:
+            checker = checkers.bit_length() - 1
+            evasions = checkers | BETWEEN[king_square][checker]
+        else:
+            evasions = FULL_BOARD
+            self._add_castling_moves(moves, color, king_square, danger)
+
+        # Pinned pieces, mapped to the line they are allowed to move along
+        if color == 'w':
+            rooks = pieces['r'] | pieces['q']
+            bishops = pieces['b'] | pieces['q']
+        else:
+            rooks = pieces['R'] | pieces['Q']
+            bishops = pieces['B'] | pieces['Q']
+        pins = {}
+        snipers = (ROOK_LINES[king_square] & rooks) | (BISHOP_LINES[king_square] & bishops)
+        for sniper in iter_squares(snipers):
+            line = BETWEEN[king_square][sniper]
+            blockers = line & occupancy
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pins[blockers.bit_length() - 1] = line | (1 << sniper)
+
+        targets_allowed = ~own & evasions
+        for square in iter_squares(own & ~(1 << king_square)):
+            name = position.squares[square]
+            allowed = targets_allowed & pins.get(square, FULL_BOARD)
+            from_pos = SQUARE_POSITIONS[square]
+            if name in 'Pp':
+                self._add_pawn_moves(moves, color, square, allowed)
+            else:
+                for target in iter_squares(piece_attacks(name, square, occupancy) & allowed):
+                    moves.append((from_pos, SQUARE_POSITIONS[target], None))
+
+        if self.en_passant is not None and color == self.turn:
+            self._add_en_passant_moves(moves, color)
+        return moves
+
+    def _add_pawn_moves(self, moves, color, square, allowed):
+        position = self.position
+        enemy = position.occupied['b' if color == 'w' else 'w']
+        step = -COLS if color == 'w' else COLS
+        targets = PAWN_ATTACKS[color][square] & enemy
+        forward = square + step
+        if position.is_empty(forward):
+            targets |= 1 << forward
+            start_row = ROWS - 2 if color == 'w' else 1
+            if square // COLS == start_row and position.is_empty(forward + step):
+                targets |= 1 << (forward + step)
+        from_pos = SQUARE_POSITIONS[square]
+        for target in iter_squares(targets & allowed):
+            to_pos = SQUARE_POSITIONS[target]
+            if to_pos[0] == 0 or to_pos[0] == ROWS - 1:
+                for promotion in PROMOTION_CHOICES:
+                    moves.append((from_pos, to_pos, promotion))
+            else:
+                moves.append((from_pos, to_pos, None))
+
+    def _add_castling_moves(self, moves, color, king_square, danger):
+        row = ROWS - 1 if color == 'w' else 0
+        if king_square != row * COLS + 4:
+            return
+        short_right, long_right = ('K', 'Q') if color == 'w' else ('k', 'q')
+        rook = 'R' if color == 'w' else 'r'
+        squares = self.position.squares
+        occupancy = self.position.occupancy
+        king_pos = SQUARE_POSITIONS[king_square]
+        if short_right in self.castling and squares[king_square + 3] == rook:
+            path = (1 << (king_square + 1)) | (1 << (king_square + 2))
+            if not occupancy & path and not danger & path:
+                moves.append((king_pos, (row, 6), None))
+        if long_right in self.castling and squares[king_square - 4] == rook:
+            path = (1 << (king_square - 1)) | (1 << (king_square - 2))
+            if not occupancy & (path | (1 << (king_square - 3))) and not danger & path:
+                moves.append((king_pos, (row, 2), None))
+
+    def _add_en_passant_moves(self, moves, color):
+        target = square_index(*self.en_passant)
+        pawns = self.position.pieces['P' if color == 'w' else 'p']
+        # Pawns that could capture onto the target are the ones the target
+        # square would attack as an enemy pawn.
+        for square in iter_squares(PAWN_ATTACKS['b' if color == 'w' else 'w'][target] & pawns):
+            move = (SQUARE_POSITIONS[square], self.en_passant, None)
+            self.make_move(*move)
+            if not self.is_in_check(color):
+                moves.append(move)
+            self.unmake_move()
+
+    def get_piece(self, row, col):
+        return self.board[row][col] if 0 <= row < ROWS and 0 <= col < COLS else None
+
+    def set_piece(self, position, piece):
+        """Place a piece (or None) on a square, keeping the bitboards in sync."""
+        row, col = position
+        square = row * COLS + col
+        previous = self.board[row][col]
+        if previous is not None:
+            self.position.remove(square, previous.name)
+        self.board[row][col] = piece
+        if piece:
+            self.position.put(square, piece.name)
+            piece.position = position
+
+    def is_in_check(self, color):
+        king_square = self.position.king_square(color)
+        if king_square is None:
+            return False
+        return self.position.is_attacked(king_square, 'b' if color == 'w' else 'w')
+
+    def game_status(self):
+        """Return 'checkmate', 'stalemate' or 'check' for the side to move, or None."""
+        in_check = self.is_in_check(self.turn)
+        if not self.generate_legal_moves():
+            return 'checkmate' if in_check else 'stalemate'
+        return 'check' if in_check else None
+
+    def evaluate(self):
+        """Return the tapered material and piece-square score in centipawns for the side to move.
+
+        The terms are kept up to date by Position as pieces move, so this
+        costs the same whatever is on the board.
+        """
+        position = self.position
+        if CHECK_EVALUATION:
+            expected = position.evaluation_terms()
+            if expected != (position.middlegame, position.endgame, position.phase):
+                raise AssertionError(f"Incremental evaluation {(position.middlegame, position.endgame, position.phase)} "
+                                     f"differs from the full count {expected} in {self.get_fen()}")
+        phase = min(position.phase, MAX_PHASE)  # Extra queens do not make it more of a middlegame
+        score = position.middlegame * phase + position.endgame * (MAX_PHASE - phase)
+        # Turn the score around before dividing so both colors round the same way
+        return (score if self.turn == 'w' else -score) // MAX_PHASE
+
+    def insufficient_material(self):
+        """Return True when neither side can mate: bare kings plus at most one knight or bishop."""
+        pieces = self.position.pieces
+        if pieces['P'] | pieces['p'] | pieces['R'] | pieces['r'] | pieces['Q'] | pieces['q']:
+            return False
+        minors = pieces['N'] | pieces['n'] | pieces['B'] | pieces['b']
+        return minors & (minors - 1) == 0
+
+    def find_king_position(self, color):
+        """Find and return the king's position of the specified color."""
+        square = self.position.king_square(color)
+        return square_position(square) if square is not None else None
+
+    def find_king(self, color):
+        """Find and return the king piece of the specified color."""
+        position = self.find_king_position(color)
+        return self.get_piece(*position) if position else None
+
+    def square_attacked(self, position, color):
+        """Return True if the opponent of `color` attacks the square."""
+        row, col = position
+        return self.position.is_attacked(row * COLS + col, 'b' if color == 'w' else 'w')
+
+    def get_fen(self):
+        fen_rows = []
+        for row in self.board:
+            fen_row = ''
+            empty_squares = 0
+            for piece in row:
+                if piece is None:
+                    empty_squares += 1
+                else:
+                    if empty_squares > 0:
+                        fen_row += str(empty_squares)
+                        empty_squares = 0
+                    # Map piece names to standard FEN letters
+                    # Ensure uppercase for white and lowercase for black
+                    fen_piece = piece.name.upper() if piece.color == 'w' else piece.name.lower()
+                    fen_row += fen_piece
+            if empty_squares > 0:
+                fen_row += str(empty_squares)
+            fen_rows.append(fen_row)
+        fen = '/'.join(fen_rows)
+        
+        # Active color
+        fen += ' ' + self.turn
+
+        # Castling availability
+        fen += ' ' + (self.castling or '-')
+
+        # En passant target square
+        fen += ' ' + (square_name(self.en_passant) if self.en_passant else '-')
+
+        # Halfmove clock and fullmove number
+        fen += f' {self.halfmove_clock} {self.fullmove_number}'
+        
+        return fen
@@ -1,21 +1,32 @@
 import pygame
 import requests
 import io
-import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from book import OpeningBook
+from chess_core import COLS, ROWS, SQUARE_POSITIONS, Board, Pawn, decode_move, move_to_uci, square_index
+from cloud_eval import CLOUD_EVAL_URL, CloudEvalClient, EvalCache
+from engine import Engine, format_score
+from journal import Journal, read_records, replay
+from parallel import ParallelSearch
+from pgn import format_game
+from tablebase import Tablebases, describe
 
 pygame.init()
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, filename='chess_game.log', filemode='w',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
 BOARD_WIDTH, HEIGHT = 800, 800
 INSTRUCTIONS_WIDTH = 450  # Extra space for the instructions
 WINDOW_WIDTH = BOARD_WIDTH + INSTRUCTIONS_WIDTH
-WINDOW = pygame.display.set_mode((WINDOW_WIDTH, HEIGHT))
-pygame.display.set_caption('Chess Game')
+# Opened by open_window() rather than on import, so parallel search workers,
+# which import this module when they start, do not open windows of their own
+WINDOW = None
 
-ROWS, COLS = 8, 8
 SQUARE_SIZE = BOARD_WIDTH // COLS
 
 WHITE = (235, 235, 208)
@@ -24,10 +35,66 @@ BACKGROUND_COLOR = (200, 200, 200)
 BUTTON_COLOR = (100, 100, 100)
 HIGHLIGHT_COLOR = (170, 170, 170)
 
+# Best Move settings: the built-in engine answers unless the lichess cloud
+# evaluation is enabled and has the position. With more than one worker the
+# search runs in parallel processes sharing one transposition table.
+ENGINE_WORKERS = 1
+if ENGINE_WORKERS > 1:
+    ENGINE = ParallelSearch(workers=ENGINE_WORKERS, max_depth=5, max_time=2.0, hash_mb=64)
+else:
+    ENGINE = Engine(max_depth=5, max_time=2.0, hash_mb=16)
+USE_CLOUD_EVAL = False
+# Work out the Best Move answer for every new position while the player
+# thinks; answers for the last PONDER_CACHE_SIZE positions are kept
+PONDER = True
+PONDER_CACHE_SIZE = 256
+CLOUD_EVAL_TIMEOUT = 5.0  # Seconds before giving up on the cloud and using the engine
+
+# Opening book consulted before the cloud and the engine; build one with book.py
+OPENING_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+# Endgame tables from tablebase.py; positions they cover get exact answers
+# and end as soon as they are known draws
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+TABLEBASES = Tablebases(TABLEBASE_DIR)
+
+# Downloaded data is kept here between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'chess_game')
+CLOUD_EVAL_CACHE = os.path.join(CACHE_DIR, 'cloud_eval.sqlite3')
+PIECE_CACHE_DIR = os.path.join(CACHE_DIR, 'pieces')
+# Every move, undo and result is appended to this journal by a background
+# thread; a game left unfinished by a crash is picked up again on the next
+# launch. Set USE_JOURNAL to False to record nothing.
+USE_JOURNAL = True
+JOURNAL_FILE = os.path.join(CACHE_DIR, 'journal.jsonl')
+# Games exported with the 'e' key are saved here
+GAMES_DIR = os.path.join(os.path.expanduser('~'), 'chess_games')
+# Optional piece images shipped with a packaged game, used before any
+# download. The repository does not include them: the PNGs are Chess.com
+# artwork, so a plain checkout downloads them once into PIECE_CACHE_DIR.
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'pieces')
+
+# Posted by the background Best Move worker with the answer to show
+BEST_MOVE_EVENT = pygame.USEREVENT + 1
+
+# Start with CHESS_METRICS=1 to show hot-path counters in the sidebar and
+# save them to METRICS_FILE on exit. METRICS_EVENT refreshes the overlay.
+SHOW_METRICS = bool(os.environ.get('CHESS_METRICS'))
+METRICS_FILE = os.path.join(CACHE_DIR, 'metrics.json')
+METRICS_EVENT = pygame.USEREVENT + 2
+METRICS_INTERVAL = 500  # Milliseconds between overlay refreshes
+if SHOW_METRICS:
+    metrics.enable()
+
+# Frame rate while a piece is dragged; otherwise the loop sleeps until an event arrives
+DRAG_FPS = 120
+
 # Global variables
 current_player = 'w'
 game_over = False
-move_history = []
+move_history = array('H')  # Moves played, packed with encode_move
+journal = None  # The Journal while main() runs with USE_JOURNAL on
+pieces_images = {}  # Filled by load_images() when the game starts
+pieces_atlas = None  # Single surface holding every piece image
 
 # Button coordinates for "Best Move" and "Resign"
 BEST_MOVE_BUTTON = pygame.Rect(BOARD_WIDTH + 20, HEIGHT - 100, 120, 40)
@@ -49,23 +116,116 @@ piece_image_urls = {
     'b_king':   'https://images.chesscomfiles.com/chess-themes/pieces/neo/150/bk.png',
 }
 
+def fetch_piece_image(url, session=requests):
+    """Return the PNG bytes for a piece image, downloading it only if there is no local copy.
+
+    Images bundled in ASSETS_DIR win over the download cache; a download is
+    saved to PIECE_CACHE_DIR so later launches never touch the network.
+    """
+    filename = url.rsplit('/', 1)[-1]
+    for directory in (ASSETS_DIR, PIECE_CACHE_DIR):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            with open(path, 'rb') as image_file:
+                return image_file.read()
+
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    os.makedirs(PIECE_CACHE_DIR, exist_ok=True)
+    path = os.path.join(PIECE_CACHE_DIR, filename)
+    with open(path + '.tmp', 'wb') as image_file:
+        image_file.write(response.content)
+    os.replace(path + '.tmp', path)
+    return response.content
+
+def draw_fallback_piece(piece_name):
+    """Draw a plain disc with the piece letter, for when no image can be had."""
+    color, kind = piece_name.split('_')
+    surface = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
+    fill, ink = ((250, 250, 250), (0, 0, 0)) if color == 'w' else ((30, 30, 30), (255, 255, 255))
+    pygame.draw.circle(surface, fill, (SQUARE_SIZE // 2, SQUARE_SIZE // 2), SQUARE_SIZE * 3 // 8)
+    pygame.draw.circle(surface, ink, (SQUARE_SIZE // 2, SQUARE_SIZE // 2), SQUARE_SIZE * 3 // 8, 2)
+    font = pygame.font.SysFont('Arial', SQUARE_SIZE // 2, bold=True)
+    letter = font.render('N' if kind == 'knight' else kind[0].upper(), True, ink)
+    surface.blit(letter, ((SQUARE_SIZE - letter.get_width()) // 2, (SQUARE_SIZE - letter.get_height()) // 2))
+    return surface
+
+def open_window():
+    """Create the game window once and return it."""
+    global WINDOW
+    if WINDOW is None:
+        WINDOW = pygame.display.set_mode((WINDOW_WIDTH, HEIGHT))
+        pygame.display.set_caption('Chess Game')
+    return WINDOW
+
 def load_images():
+    """Return the piece images, building the sprite atlas on the first call.
+
+    All twelve images are decoded and scaled to SQUARE_SIZE once, into a
+    single atlas surface; the returned surfaces are views into it. Later
+    calls return the same dictionary without any I/O.
+    """
+    global pieces_atlas
+    if pieces_images:
+        return pieces_images
+
+    session = requests.Session()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        downloads = {piece_name: executor.submit(fetch_piece_image, url, session)
+                     for piece_name, url in piece_image_urls.items()}
+
+    pieces_atlas = pygame.Surface((SQUARE_SIZE * len(piece_image_urls), SQUARE_SIZE), pygame.SRCALPHA).convert_alpha()
     pieces = {}
-    for piece_name, url in piece_image_urls.items():
+    for index, (piece_name, download) in enumerate(downloads.items()):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            image_data = response.content
-            image_file = io.BytesIO(image_data)
-            image = pygame.image.load(image_file).convert_alpha()
-            image = pygame.transform.scale(image, (SQUARE_SIZE, SQUARE_SIZE))
-            pieces[piece_name] = image
+            image = pygame.image.load(io.BytesIO(download.result())).convert_alpha()
         except Exception as e:
-            logging.error(f"Error loading {piece_name}: {e}")
             print(f"Error loading {piece_name}: {e}")
+            image = draw_fallback_piece(piece_name)
+        image = pygame.transform.smoothscale(image, (SQUARE_SIZE, SQUARE_SIZE))
+        rect = pygame.Rect(index * SQUARE_SIZE, 0, SQUARE_SIZE, SQUARE_SIZE)
+        pieces_atlas.blit(image, rect)
+        pieces[piece_name] = pieces_atlas.subsurface(rect)
+    session.close()
     return pieces
 
-def draw_board(window):
+# Layers that never change are rendered once and reused every frame
+_board_surface = None
+_sidebar_surfaces = {}
+_text_cache = OrderedDict()  # Least recently used first
+TEXT_CACHE_SIZE = 64
+_highlight_surface = None
+SIDEBAR_RECT = pygame.Rect(BOARD_WIDTH, 0, INSTRUCTIONS_WIDTH, HEIGHT)
+METRICS_RECT = pygame.Rect(BOARD_WIDTH + 20, 555, INSTRUCTIONS_WIDTH - 40, 90)
+METRICS_FONT = pygame.font.SysFont('Arial', 18)
+WINDOW_RECT = pygame.Rect(0, 0, WINDOW_WIDTH, HEIGHT)
+
+
+def render_text(font, text, color):
+    """Render a line of text once and return the cached surface afterwards.
+
+    Only the TEXT_CACHE_SIZE most recently used lines are kept, so changing
+    texts such as Best Move answers do not pile up over a session.
+    """
+    key = (id(font), text, color)
+    surface = _text_cache.get(key)
+    if surface is None:
+        surface = _text_cache[key] = font.render(text, True, color)
+        if len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+    else:
+        _text_cache.move_to_end(key)
+    return surface
+
+
+def square_rect(position):
+    row, col = position
+    return pygame.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+
+def render_board_surface():
+    """Draw the squares with their coordinates onto a surface of their own."""
+    surface = pygame.Surface((BOARD_WIDTH, HEIGHT))
     colors = [WHITE, BLACK]
     font = pygame.font.SysFont('Arial', 24, bold=True)
     letters = 'abcdefgh'
@@ -76,19 +236,31 @@ def draw_board(window):
             color = colors[(row + col) % 2]
             x = col * SQUARE_SIZE
             y = row * SQUARE_SIZE
-            pygame.draw.rect(window, color, (x, y, SQUARE_SIZE, SQUARE_SIZE))
+            pygame.draw.rect(surface, color, (x, y, SQUARE_SIZE, SQUARE_SIZE))
 
             # Draw rank numbers (1-8) along the left and right edges
             if col == 0:
                 # Left side numbers
                 number = font.render(numbers[7 - row], True, (0, 0, 0))
-                window.blit(number, (x + 5, y + 5))
+                surface.blit(number, (x + 5, y + 5))
 
             # Draw file letters (a-h) along the top and bottom edges
             if row == ROWS - 1:
                 # Bottom letters
                 letter = font.render(letters[col], True, (0, 0, 0))
-                window.blit(letter, (x + SQUARE_SIZE - 20, y + SQUARE_SIZE - 25))
+                surface.blit(letter, (x + SQUARE_SIZE - 20, y + SQUARE_SIZE - 25))
+    return surface
+
+
+def draw_board(window):
+    global _board_surface
+    if _board_surface is None:
+        _board_surface = render_board_surface()
+    window.blit(_board_surface, (0, 0))
+
+
+def piece_image(piece):
+    return pieces_images[f"{piece.color}_{type(piece).__name__.lower()}"]
 
 
 def draw_pieces(window, board, exclude_piece=None):
@@ -98,15 +270,17 @@ def draw_pieces(window, board, exclude_piece=None):
             if piece is not None and piece != exclude_piece:
                 x = col * SQUARE_SIZE
                 y = row * SQUARE_SIZE
-                window.blit(piece.image, (x, y))
+                window.blit(piece_image(piece), (x, y))
 
 def highlight_valid_moves(window, moves):
+    global _highlight_surface
+    if _highlight_surface is None:
+        _highlight_surface = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
+        _highlight_surface.set_alpha(100)  # Transparency
+        _highlight_surface.fill((255, 0 , 0))  # Red highlight
     for move in moves:
         row, col = move
-        s = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)  # Transparency
-        s.fill((255, 0 , 0))  # Green highlight
-        window.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
+        window.blit(_highlight_surface, (col * SQUARE_SIZE, row * SQUARE_SIZE))
 
 def get_row_col_from_mouse(pos):
     x, y = pos
@@ -117,27 +291,21 @@ def get_row_col_from_mouse(pos):
 def draw_button(window, rect, text, font, active=False):
     color = HIGHLIGHT_COLOR if active else BUTTON_COLOR
     pygame.draw.rect(window, color, rect)
-    button_text = font.render(text, True, (255, 255, 255))
+    button_text = render_text(font, text, (255, 255, 255))
     window.blit(button_text, (
         rect.x + (rect.width - button_text.get_width()) // 2,
         rect.y + (rect.height - button_text.get_height()) // 2
     ))
 
-def draw_instructions(window, font, current_player, best_move_text):
-    # Sidebar background
-    pygame.draw.rect(window, BACKGROUND_COLOR, (BOARD_WIDTH, 0, INSTRUCTIONS_WIDTH, HEIGHT))
-    
+def render_sidebar_surface(font):
+    """Draw the parts of the sidebar that never change: title, instructions and buttons."""
+    surface = pygame.Surface((INSTRUCTIONS_WIDTH, HEIGHT))
+    surface.fill(BACKGROUND_COLOR)
+    offset = (-BOARD_WIDTH, 0)
+
     # Title
     title = font.render("Chess Instructions", True, (0, 0, 0))
-    window.blit(title, (BOARD_WIDTH + 20, 20))
-
-    # Current player info
-    player_color = (255, 255, 255) if current_player == 'w' else (0, 0, 0)
-    player_background = (255, 255, 255) if current_player == 'w' else (0, 0, 0)
-    current_player_button = pygame.Rect(BOARD_WIDTH + 20, 80, 40, 50)
-    pygame.draw.rect(window, player_background, current_player_button)
-    current_player_text = font.render(f"{'     White to move ' if current_player == 'w' else '     Black to move'}", True, player_color)
-    window.blit(current_player_text, (BOARD_WIDTH + 30, 90))
+    surface.blit(title, (20, 20))
 
     # Instructions
     instructions = [
@@ -149,6 +317,7 @@ def draw_instructions(window, font, current_player, best_move_text):
         "- Click and drag a piece to move it.",
         "- Press 'r' to restart.",
         "- Press 'u' to undo the last move.",
+        "- Press 'e' to export the game (PGN).",
         "",
         "Special Moves:",
         "",
@@ -160,22 +329,69 @@ def draw_instructions(window, font, current_player, best_move_text):
     ]
     for i, line in enumerate(instructions):
         instruction_text = font.render(line, True, (0, 0, 0))
-        window.blit(instruction_text, (BOARD_WIDTH + 20, 120 + 30 * i))
+        surface.blit(instruction_text, (20, 120 + 30 * i))
+
+    # Best Move and Resign buttons
+    draw_button(surface, BEST_MOVE_BUTTON.move(offset), "Best Move", font)
+    draw_button(surface, RESIGN_BUTTON.move(offset), "Resign", font)
+    return surface
 
-    # Best Move button
-    draw_button(window, BEST_MOVE_BUTTON, "Best Move", font)
 
-    # Resign button
-    draw_button(window, RESIGN_BUTTON, "Resign", font)
+def draw_instructions(window, font, current_player, best_move_text, metrics_lines=None):
+    sidebar = _sidebar_surfaces.get(id(font))
+    if sidebar is None:
+        sidebar = _sidebar_surfaces[id(font)] = render_sidebar_surface(font)
+    window.blit(sidebar, SIDEBAR_RECT)
+
+    # Current player info
+    player_color = (255, 255, 255) if current_player == 'w' else (0, 0, 0)
+    player_background = (255, 255, 255) if current_player == 'w' else (0, 0, 0)
+    current_player_button = pygame.Rect(BOARD_WIDTH + 20, 80, 40, 50)
+    pygame.draw.rect(window, player_background, current_player_button)
+    current_player_text = render_text(font, f"{'     White to move ' if current_player == 'w' else '     Black to move'}", player_color)
+    window.blit(current_player_text, (BOARD_WIDTH + 30, 90))
 
     # Display Best Move
     if best_move_text:
-        move_text = font.render(best_move_text, True, (0, 0, 0))
+        move_text = render_text(font, best_move_text, (0, 0, 0))
         window.blit(move_text, (BOARD_WIDTH + 20, HEIGHT - 150))
 
-
-def handle_promotion(window, board, position):
-    """Handle pawn promotion by prompting the player to choose a piece."""
+    # Metrics overlay; the numbers change all the time, so they are not cached
+    if metrics_lines:
+        for i, line in enumerate(metrics_lines):
+            window.blit(METRICS_FONT.render(line, True, (60, 60, 60)), (METRICS_RECT.x, METRICS_RECT.y + 22 * i))
+
+
+# What is visible in one frame; drag_rect and check_rect are None when not shown
+FrameState = namedtuple('FrameState', 'squares highlights drag_rect check_rect player best_move_text metrics_lines')
+
+
+def dirty_rects(previous, frame):
+    """Return the screen rectangles that differ between two FrameStates.
+
+    Everything is dirty when there is no previous frame, e.g. after a popup
+    covered the window.
+    """
+    if previous is None:
+        return [WINDOW_RECT]
+    rects = []
+    for square, (old, new) in enumerate(zip(previous.squares, frame.squares)):
+        if old != new:
+            rects.append(square_rect(SQUARE_POSITIONS[square]))
+    rects.extend(square_rect(position) for position in previous.highlights ^ frame.highlights)
+    for field in ('drag_rect', 'check_rect'):
+        old, new = getattr(previous, field), getattr(frame, field)
+        if old != new:
+            rects.extend(pygame.Rect(rect) for rect in (old, new) if rect)
+    if previous.player != frame.player or previous.best_move_text != frame.best_move_text:
+        rects.append(SIDEBAR_RECT)
+    elif previous.metrics_lines != frame.metrics_lines:
+        rects.append(METRICS_RECT)
+    return [rect.clip(WINDOW_RECT) for rect in rects]
+
+
+def handle_promotion(window):
+    """Prompt the player for a promotion piece and return its letter ('q', 'r', 'b' or 'n')."""
     promotion = True
     chosen_piece = None
     clock = pygame.time.Clock()
@@ -232,516 +448,274 @@ def handle_promotion(window, board, position):
         pygame.display.update()
         clock.tick(30)
 
-    # Replace the pawn with the chosen piece
-    row, col = position
-    piece_images = load_images()  # Ensure images are loaded
-    if chosen_piece == 'queen':
-        board.board[row][col] = Queen(board.board[row][col].color, piece_images[f"{board.board[row][col].color}_queen"])
-    elif chosen_piece == 'rook':
-        board.board[row][col] = Rook(board.board[row][col].color, piece_images[f"{board.board[row][col].color}_rook"])
-    elif chosen_piece == 'bishop':
-        board.board[row][col] = Bishop(board.board[row][col].color, piece_images[f"{board.board[row][col].color}_bishop"])
-    elif chosen_piece == 'knight':
-        board.board[row][col] = Knight(board.board[row][col].color, piece_images[f"{board.board[row][col].color}_knight"])
-
-    board.board[row][col].position = (row, col)
-    board.board[row][col].has_moved = True
-
-class Piece:
-    def __init__(self, color, image, name):
-        self.color = color
-        self.image = image
-        self.name = name
-        self.position = None
-        self.has_moved = False
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        """Generate potential moves for the piece.
-        
-        Args:
-            position (tuple): Current position (row, col) of the piece.
-            board (Board): The current game board.
-            for_attack (bool): If True, exclude special moves like castling.
-        
-        Returns:
-            list: List of potential move positions (row, col).
-        """
-        return []
-
-    def get_valid_moves(self, position, board):
-        """Return a list of valid moves, ensuring the king is not left in check."""
-        potential_moves = self.get_potential_moves(position, board, for_attack=False)
-        valid_moves = []
-
-        for move in potential_moves:
-            # Simulate the move
-            original_piece = board.get_piece(*move)
-            original_position = self.position
-
-            board.set_piece(move, self)
-            board.set_piece(position, None)
-            self.position = move
-
-            # Check if move leaves the king in check
-            if not board.is_in_check(self.color):
-                valid_moves.append(move)
-
-            # Undo the move
-            board.set_piece(position, self)
-            board.set_piece(move, original_piece)
-            self.position = original_position
-
-        return valid_moves
-
-class Pawn(Piece):
-    def __init__(self, color, image):
-        name = 'P' if color == 'w' else 'p'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        direction = -1 if self.color == 'w' else 1
-        row, col = position
-
-        # Forward move
-        if board.is_empty(row + direction, col):
-            moves.append((row + direction, col))
-            # Double move from starting position
-            if (self.color == 'w' and row == 6) or (self.color == 'b' and row == 1):
-                if board.is_empty(row + 2 * direction, col):
-                    moves.append((row + 2 * direction, col))
-
-        # Captures
-        for dc in [-1, 1]:
-            new_row, new_col = row + direction, col + dc
-            if 0 <= new_col < COLS and 0 <= new_row < ROWS:
-                if board.is_enemy(new_row, new_col, self.color):
-                    moves.append((new_row, new_col))
-                # En passant can be added here in future
-
-        # Promotion can be handled during move execution
-
-        return moves
-
-class Rook(Piece):
-    def __init__(self, color, image):
-        name = 'R' if color == 'w' else 'r'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        row, col = position
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]  # Vertical and horizontal directions
-
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            while 0 <= r < ROWS and 0 <= c < COLS:
-                if board.is_empty(r, c):
-                    moves.append((r, c))
-                elif board.is_enemy(r, c, self.color):
-                    moves.append((r, c))
-                    break  # Stop if there's an enemy piece
-                else:
-                    break  # Stop if there's a friendly piece
-                r += dr
-                c += dc
-        return moves
-
-class Knight(Piece):
-    def __init__(self, color, image):
-        name = 'N' if color == 'w' else 'n'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        row, col = position
-        knight_moves = [
-            (-2, -1), (-2, 1), (-1, -2), (-1, 2),
-            (1, -2),  (1, 2),  (2, -1),  (2, 1)
-        ]
-
-        for dr, dc in knight_moves:
-            r, c = row + dr, col + dc
-            if 0 <= r < ROWS and 0 <= c < COLS:
-                if board.is_empty(r, c) or board.is_enemy(r, c, self.color):
-                    moves.append((r, c))
-        return moves
-
-class Bishop(Piece):
-    def __init__(self, color, image):
-        name = 'B' if color == 'w' else 'b'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        row, col = position
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            while 0 <= r < ROWS and 0 <= c < COLS:
-                if board.is_empty(r, c):
-                    moves.append((r, c))
-                elif board.is_enemy(r, c, self.color):
-                    moves.append((r, c))
-                    break
-                else:
-                    break
-                r += dr
-                c += dc
-        return moves
-
-class Queen(Piece):
-    def __init__(self, color, image):
-        name = 'Q' if color == 'w' else 'q'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        row, col = position
-        directions = [
-            (-1, 0), (1, 0), (0, -1), (0, 1),   # Rook-like moves
-            (-1, -1), (-1, 1), (1, -1), (1, 1)  # Bishop-like moves
-        ]
-
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            while 0 <= r < ROWS and 0 <= c < COLS:
-                if board.is_empty(r, c):
-                    moves.append((r, c))
-                elif board.is_enemy(r, c, self.color):
-                    moves.append((r, c))
-                    break
-                else:
-                    break
-                r += dr
-                c += dc
-        return moves
-
-class King(Piece):
-    def __init__(self, color, image):
-        name = 'K' if color == 'w' else 'k'
-        super().__init__(color, image, name)
-
-    def get_potential_moves(self, position, board, for_attack=False):
-        moves = []
-        row, col = position
-        king_moves = [
-            (-1, -1), (-1, 0), (-1, 1),
-            (0, -1),          (0, 1),
-            (1, -1),  (1, 0),  (1, 1)
-        ]
-
-        for dr, dc in king_moves:
-            r, c = row + dr, col + dc
-            if 0 <= r < ROWS and 0 <= c < COLS:
-                if board.is_empty(r, c) or board.is_enemy(r, c, self.color):
-                    moves.append((r, c))
-
-        if not self.has_moved and not board.is_in_check(self.color) and not for_attack:
-            if self.can_castle_short(board):
-                moves.append((row, col + 2))
-            if self.can_castle_long(board):
-                moves.append((row, col - 2))
-
-        return moves
-    
-    def get_valid_moves(self, position, board):
-        potential_moves = self.get_potential_moves(position, board)
-        valid_moves = []
-        for move in potential_moves:
-            # Simulate the move
-            original_piece = board.get_piece(*move)
-            original_position = self.position
-
-            board.set_piece(move, self)
-            board.set_piece(position, None)
-            self.position = move
-
-            # Check if move leaves the king in check
-            if not board.is_in_check(self.color):
-                valid_moves.append(move)
-
-            # Undo the move
-            board.set_piece(position, self)
-            board.set_piece(move, original_piece)
-            self.position = original_position
-
-        return valid_moves
-
-    def can_castle_short(self, board):
-        row = self.position[0]
-        rook = board.get_piece(row, 7)
-        if isinstance(rook, Rook) and not rook.has_moved:
-            if board.is_empty(row, 5) and board.is_empty(row, 6):
-                # Ensure squares are not under attack
-                if not board.square_attacked((row, 5), self.color) and not board.square_attacked((row, 6), self.color):
-                    return True
-        return False
-
-    def can_castle_long(self, board):
-        row = self.position[0]
-        rook = board.get_piece(row, 0)
-        if isinstance(rook, Rook) and not rook.has_moved:
-            if board.is_empty(row, 1) and board.is_empty(row, 2) and board.is_empty(row, 3):
-                if not board.square_attacked((row, 2), self.color) and not board.square_attacked((row, 3), self.color):
-                    return True
-        return False
-
-class Board:
-    def __init__(self):
-        self.board = []
-        self.create_board()
-
-    def create_board(self):
-        self.board = [[None for _ in range(COLS)] for _ in range(ROWS)]
-        for col in range(COLS):
-            self.board[6][col] = Pawn('w', pieces_images['w_pawn'])
-            self.board[6][col].position = (6, col)
-            self.board[1][col] = Pawn('b', pieces_images['b_pawn'])
-            self.board[1][col].position = (1, col)
-
-        # Place other pieces
-        placement = [
-            ('w_rook', Rook), ('w_knight', Knight), ('w_bishop', Bishop),
-            ('w_queen', Queen), ('w_king', King),
-            ('w_bishop', Bishop), ('w_knight', Knight), ('w_rook', Rook)
-        ]
-        for col, (piece_name, piece_class) in enumerate(placement):
-            self.board[7][col] = piece_class('w', pieces_images[piece_name])
-            self.board[7][col].position = (7, col)
-
-        placement = [
-            ('b_rook', Rook), ('b_knight', Knight), ('b_bishop', Bishop),
-            ('b_queen', Queen), ('b_king', King),
-            ('b_bishop', Bishop), ('b_knight', Knight), ('b_rook', Rook)
-        ]
-        for col, (piece_name, piece_class) in enumerate(placement):
-            self.board[0][col] = piece_class('b', pieces_images[piece_name])
-            self.board[0][col].position = (0, col)
-
-    def is_empty(self, row, col):
-        """Check if a specific square is empty."""
-        if 0 <= row < ROWS and 0 <= col < COLS:
-            return self.board[row][col] is None
-        return False
-
-    def is_enemy(self, row, col, color):
-        if 0 <= row < ROWS and 0 <= col < COLS:
-            piece = self.board[row][col]
-            return piece is not None and piece.color != color
-        return False
-
-    def move_piece(self, from_pos, to_pos):
-        fr, fc = from_pos
-        tr, tc = to_pos
-        piece = self.board[fr][fc]
-        captured_piece = self.board[tr][tc]
-
-        logging.debug(f"Moving {piece.name} from ({fr}, {fc}) to ({tr}, {tc})")
-        if captured_piece:
-            logging.debug(f"Captured {captured_piece.name} at ({tr}, {tc})")
-
-        # Move the piece
-        self.board[tr][tc] = piece
-        self.board[fr][fc] = None
-        piece.position = (tr, tc)
-        piece.has_moved = True
-
-        # Handle Castling
-        if isinstance(piece, King):
-            if tc - fc == 2:
-                logging.debug("Performing short castling")
-                self.move_rook((fr, 7), (fr, 5))
-            elif tc - fc == -2:
-                logging.debug("Performing long castling")
-                self.move_rook((fr, 0), (fr, 3))
-
-        # Check for pawn promotion
-        promotion = False
-        if isinstance(piece, Pawn):
-            if (piece.color == 'w' and tr == 0) or (piece.color == 'b' and tr == 7):
-                promotion = True
-
-        return promotion, (tr, tc) if promotion else None
-
-    def move_rook(self, from_pos, to_pos):
-        fr, fc = from_pos
-        tr, tc = to_pos
-        rook = self.board[fr][fc]
-
-        if rook is not None and isinstance(rook, Rook):
-            self.board[tr][tc] = rook
-            self.board[fr][fc] = None
-            rook.position = (tr, tc)
-            rook.has_moved = True
-
-    def get_piece(self, row, col):
-        return self.board[row][col] if 0 <= row < ROWS and 0 <= col < COLS else None
-
-    def set_piece(self, position, piece):
-        row, col = position
-        self.board[row][col] = piece
-        if piece:
-            piece.position = position
-
-    def is_in_check(self, color):
-        king_position = self.find_king_position(color)
-        if king_position is None:
-            return False
-
-        opponent_color = 'b' if color == 'w' else 'w'
-        for row in range(ROWS):
-            for col in range(COLS):
-                piece = self.board[row][col]
-                if piece and piece.color == opponent_color and piece.name.lower() != 'k':  # Exclude King
-                    potential_moves = piece.get_potential_moves((row, col), self, for_attack=True)
-                    if king_position in potential_moves:
-                        return True
-        return False
-    
-    def find_king_position(self, color):
-        """Find and return the king's position of the specified color."""
-        for row in range(ROWS):
-            for col in range(COLS):
-                piece = self.board[row][col]
-                if piece and isinstance(piece, King) and piece.color == color:
-                    return (row, col)  # Return the position as a tuple
-        return None  # Return None if the king is not found
-
-    def find_king(self, color):
-        """Find and return the king's position of the specified color."""
-        for row in range(ROWS):
-            for col in range(COLS):
-                piece = self.board[row][col]
-                if piece and isinstance(piece, King) and piece.color == color:
-                    return piece  # Return the position as a tuple
-        return None  # Return None if the king is not found
-
-    def square_attacked(self, position, color):
-        opponent_color = 'b' if color == 'w' else 'w'
-        for row in range(ROWS):
-            for col in range(COLS):
-                piece = self.board[row][col]
-                if piece and piece.color == opponent_color:
-                    potential_moves = piece.get_potential_moves((row, col), self, for_attack=True)
-                    if position in potential_moves:
-                        return True
-        return False
-
-    def get_fen(self):
-        fen_rows = []
-        for row in self.board:
-            fen_row = ''
-            empty_squares = 0
-            for piece in row:
-                if piece is None:
-                    empty_squares += 1
-                else:
-                    if empty_squares > 0:
-                        fen_row += str(empty_squares)
-                        empty_squares = 0
-                    # Map piece names to standard FEN letters
-                    # Ensure uppercase for white and lowercase for black
-                    fen_piece = piece.name.upper() if piece.color == 'w' else piece.name.lower()
-                    fen_row += fen_piece
-            if empty_squares > 0:
-                fen_row += str(empty_squares)
-            fen_rows.append(fen_row)
-        fen = '/'.join(fen_rows)
-        
-        # Active color
-        fen += ' ' + ('w' if current_player == 'w' else 'b')
-        
-        # Castling availability
-        castling = ''
-        # White king
-        white_king = self.find_king('w')
-        if white_king and not white_king.has_moved:
-            row, col = white_king.position
-            # Check rooks
-            rook = self.get_piece(7, 7)
-            if isinstance(rook, Rook) and not rook.has_moved:
-                castling += 'K'
-            rook = self.get_piece(7, 0)
-            if isinstance(rook, Rook) and not rook.has_moved:
-                castling += 'Q'
-        # Black king
-        black_king = self.find_king('b')
-        if black_king and not black_king.has_moved:
-            row, col = black_king.position
-            # Check rooks
-            rook = self.get_piece(0, 7)
-            if isinstance(rook, Rook) and not rook.has_moved:
-                castling += 'k'
-            rook = self.get_piece(0, 0)
-            if isinstance(rook, Rook) and not rook.has_moved:
-                castling += 'q'
-        if castling == '':
-            castling = '-'
-        fen += ' ' + castling
-        
-        # En passant target square (always '-')
-        fen += ' -'
-        
-        # Halfmove clock and fullmove number (set to defaults)
-        fen += ' 0 1'
-        
-        return fen
-
-def game_over_popup(winner):
+    return 'n' if chosen_piece == 'knight' else chosen_piece[0]
+
+def engine_best_move(board, stop=None):
+    """Search the position with the built-in engine and describe the result."""
+    result = ENGINE.search(board, stop=stop)
+    if stop is not None and stop.is_set():
+        return None  # Cancelled; nobody wants this answer
+    if result.move is None:
+        return "No legal moves"
+    # Report the score from White's point of view, like the cloud evaluation
+    score = result.score if board.turn == 'w' else -result.score
+    print(f"Best move: {move_to_uci(result.move)} ({format_score(score)}, depth {result.depth}, "
+          f"{result.nodes} nodes in {result.seconds:.2f}s)")
+    return f"Best move: {move_to_uci(result.move)} ({format_score(score)})"
+
+def cloud_best_move(fen, client):
+    """Ask the lichess cloud evaluation for the best move; return None if it has none."""
+    try:
+        data = client.evaluate(fen)
+        if 'pvs' in data and len(data['pvs']) > 0:
+            best_pv = data['pvs'][0]
+            best_moves = best_pv['moves']
+            best_move = best_moves.split(' ')[0]
+            print(f"Best move: {best_move} (cache: {client.cache.stats()})")
+            return f"Best move: {best_move}"
+        print("No best move found in response:", data)
+    except requests.exceptions.HTTPError as http_err:
+        print("HTTP error occurred:", http_err)
+        print("Response content:", http_err.response.content if http_err.response is not None else b'')
+    except Exception as err:
+        print("An error occurred:", err)
+    return None
+
+class BestMoveService:
+    """Evaluates Best Move requests on a background thread.
+
+    Each answer is posted to the event loop as a BEST_MOVE_EVENT carrying the
+    request id and the text to show. Cancelling a request stops the engine
+    and drops the answer, so a position that has changed never gets a stale
+    suggestion.
+
+    ponder() starts on a position before anyone asks. Its answer is kept by
+    position key, and the engine's transposition table keeps the search, so
+    a later request for that position is answered at once. A request that
+    comes in while its position is still being pondered waits for that
+    search instead of starting another.
+    """
+    def __init__(self, cloud_client=None, book=None):
+        if cloud_client is None:
+            cloud_client = CloudEvalClient(CLOUD_EVAL_URL, CLOUD_EVAL_TIMEOUT, EvalCache(CLOUD_EVAL_CACHE))
+        if book is None and os.path.exists(OPENING_BOOK):
+            book = OpeningBook(OPENING_BOOK)
+        self.cloud_client = cloud_client
+        self.book = book
+        self.request_id = 0
+        self._cancel = None
+        self._ponder_cancel = None
+        self._pondering = None  # Key of the position being pondered
+        self._waiting = None  # (key, request id) of a request waiting for the ponder search
+        self._answers = OrderedDict()  # Pondered answers by position key
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='best-move')
+
+    def request(self, board):
+        """Start evaluating the board's position and return the request id."""
+        self._cancel_request()
+        self.request_id += 1
+        key = board.zobrist_key()
+        with self._lock:
+            text = self._answers.get(key)
+            if text is None and self._pondering == key:
+                self._waiting = (key, self.request_id)
+                return self.request_id
+        if text is not None:
+            self._post(self.request_id, text)
+            return self.request_id
+        self._stop_pondering()
+        self._cancel = threading.Event()
+        self._executor.submit(self._evaluate, self.request_id, board.copy(), self._cancel)
+        return self.request_id
+
+    def ponder(self, board):
+        """Start working out the answer for the board's position in the background."""
+        self.cancel()
+        key = board.zobrist_key()
+        if not PONDER or key in self._answers:
+            return
+        self._pondering = key
+        self._ponder_cancel = threading.Event()
+        self._executor.submit(self._ponder, key, board.copy(), self._ponder_cancel)
+
+    def cancel(self):
+        """Drop the pending request and stop pondering."""
+        self._cancel_request()
+        self._stop_pondering()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=True)
+        self.cloud_client.close()
+        if self.book is not None:
+            self.book.close()
+
+    def _cancel_request(self):
+        if self._cancel is not None:
+            self._cancel.set()
+            self._cancel = None
+        with self._lock:
+            self._waiting = None
+
+    def _stop_pondering(self):
+        if self._ponder_cancel is not None:
+            self._ponder_cancel.set()
+            self._ponder_cancel = None
+        with self._lock:
+            self._pondering = None
+            self._waiting = None
+
+    def _post(self, request_id, text):
+        pygame.event.post(pygame.event.Event(BEST_MOVE_EVENT, request_id=request_id, text=text))
+
+    def _answer(self, board, cancel):
+        text = None
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move is not None:
+                print(f"Best move: {move_to_uci(move)} (book)")
+                text = f"Best move: {move_to_uci(move)} (book)"
+        if not text:
+            answer = TABLEBASES.best_move(board)
+            if answer is not None:
+                move, result, plies = answer
+                text = f"Best move: {move_to_uci(move)} ({describe(result, plies)})"
+                print(text)
+        if not text and USE_CLOUD_EVAL:
+            text = cloud_best_move(board.get_fen(), self.cloud_client)
+        if not text and not cancel.is_set():
+            text = engine_best_move(board, stop=cancel)
+        return text
+
+    def _evaluate(self, request_id, board, cancel):
+        text = None
+        try:
+            text = self._answer(board, cancel)
+        except Exception as error:
+            print("Best move failed:", error)
+            text = "Best move failed"
+        finally:
+            if not cancel.is_set():
+                self._post(request_id, text)
+
+    def _ponder(self, key, board, cancel):
+        text = None
+        try:
+            text = self._answer(board, cancel)
+        except Exception as error:
+            print("Pondering failed:", error)
+        finally:
+            # A cancelled ponder was already cleared by whoever cancelled it
+            if not cancel.is_set():
+                with self._lock:
+                    if text:
+                        self._answers[key] = text
+                        while len(self._answers) > PONDER_CACHE_SIZE:
+                            self._answers.popitem(last=False)
+                    self._pondering = None
+                    waiting, self._waiting = self._waiting, None
+                if waiting is not None and waiting[0] == key:
+                    self._post(waiting[1], text or "Best move failed")
+
+def game_over_popup(winner, draw=False):
     font = pygame.font.SysFont('Arial', 64)
-    text_surface = font.render(f"{winner} Wins!", True, (255, 0, 0))
+    text_surface = font.render("Draw!" if draw else f"{winner} Wins!", True, (255, 0, 0))
     WINDOW.fill((0, 0, 0))
     WINDOW.blit(text_surface, (WINDOW_WIDTH // 2 - text_surface.get_width() // 2, HEIGHT // 2 - text_surface.get_height() // 2))
     pygame.display.update()
     pygame.time.wait(3000)
 
 
+GAME_OVER_STATUSES = ('checkmate', 'stalemate', 'draw')
+
+def end_game(board, status):
+    """Record and announce a game that ended in `status`, then return a new board."""
+    winner = 'w' if board.turn == 'b' else 'b'  # Only counts for checkmate
+    if journal is not None:
+        result = ('1-0' if winner == 'w' else '0-1') if status == 'checkmate' else '1/2-1/2'
+        journal.record('end', result=result, reason=status)
+    if status == 'checkmate':
+        game_over_popup("White" if winner == 'w' else "Black")
+    else:
+        game_over_popup(None, draw=True)
+    return restart_game()
+
 def restart_game():
     global current_player, game_over, move_history
     board = Board()
     current_player = 'w'
     game_over = False
-    move_history = []
+    move_history = array('H')
+    if journal is not None:
+        journal.record('restart', fen=board.get_fen())
     return board
 
+def resume_game():
+    """Return the game the journal shows was cut short, or None.
+
+    A game counts as cut short when it has moves, no result, and the
+    session that played it did not close normally.
+    """
+    global current_player, move_history
+    records = list(read_records(JOURNAL_FILE))
+    if not records or records[-1].get('event') == 'exit':
+        return None
+    try:
+        _, board, moves, result = replay(records)
+    except ValueError:
+        return None
+    if not moves or result is not None:
+        return None
+    move_history = array('H', (state & 0xFFFF for state in board.undo_stack))
+    current_player = board.turn
+    return board
+
+def export_game():
+    """Save the moves played so far as a PGN file in GAMES_DIR and return its path."""
+    os.makedirs(GAMES_DIR, exist_ok=True)
+    path = os.path.join(GAMES_DIR, time.strftime('game_%Y%m%d_%H%M%S.pgn'))
+    headers = {'Event': 'Casual game', 'Site': 'Chess Game', 'Date': time.strftime('%Y.%m.%d')}
+    with open(path, 'w', encoding='utf-8') as pgn_file:
+        pgn_file.write(format_game([decode_move(code) for code in move_history], headers))
+    return path
+
 def undo_last_move(board):
-    global move_history
     global current_player
 
     if not move_history:
         print("No moves to undo.")
         return board
 
-    last_moves = move_history.pop()
-
-    # Ensure last_moves is a list
-    if isinstance(last_moves, dict):
-        last_moves = [last_moves]
+    move_history.pop()
+    board.unmake_move()
+    if journal is not None:
+        journal.record('undo')
 
-    # Undo in reverse order to handle dependencies (e.g., king before rook)
-    for move in reversed(last_moves):
-        board.set_piece(move['from'], move['piece'])
-        board.set_piece(move['to'], move['captured'])
-
-        # If needed, handle additional state resets here
-        if 'castle' in move:
-            # Example: Reset castling rights if tracked
-            move['piece'].has_moved = False
-            pass
-
-    # Toggle the player turn
-    current_player = 'b' if current_player == 'w' else 'w'
+    # Give the turn back to the player who made the move
+    current_player = board.turn
 
     return board
 
 def main():
-    global current_player, game_over
+    global current_player, game_over, journal
+    open_window()
     run = True
     clock = pygame.time.Clock()
-    board = Board()
+    board = None
+    if USE_JOURNAL:
+        board = resume_game()
+        journal = Journal(JOURNAL_FILE)
+        if board is not None:
+            print(f"Resumed the unfinished game after {len(move_history)} moves")
+            journal.record('resume')
+    if board is None:
+        board = Board()
+        if journal is not None:
+            journal.record('start', fen=board.get_fen())
     best_move_text = ""
+    best_move_service = BestMoveService()
+    best_move_request = None
 
     dragging = False
     dragging_piece = None
@@ -750,28 +724,63 @@ def main():
 
     font = pygame.font.SysFont('Arial', 32)
 
-    while run:
-        clock.tick(60)
-        draw_board(WINDOW)
-        draw_pieces(WINDOW, board, exclude_piece=dragging_piece)
-
-        if valid_moves:
-            highlight_valid_moves(WINDOW, valid_moves)
+    check_text = render_text(font, 'Check!', (255, 0, 0))
+    check_rect = tuple(check_text.get_rect(midtop=(BOARD_WIDTH // 2, 10)))
+    previous_frame = None  # None forces a full redraw
+    status = board.game_status()  # Updated whenever the position changes
+    if status in GAME_OVER_STATUSES:
+        # The crash came after the game was decided but before it was recorded
+        board = end_game(board, status)
+        status = None
+
+    # The dragged piece follows pygame.mouse.get_pos(), so motion events
+    # would only wake the loop for nothing
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
+    if SHOW_METRICS:
+        pygame.time.set_timer(METRICS_EVENT, METRICS_INTERVAL)
 
+    while run:
+        if SHOW_METRICS:
+            frame_start = time.perf_counter()
+        # Work out what is on screen now and redraw only what changed
+        squares = list(board.position.squares)
+        drag_rect = None
         if dragging and dragging_piece:
             mouse_x, mouse_y = pygame.mouse.get_pos()
-            WINDOW.blit(dragging_piece.image, (mouse_x - dragging_offset[0], mouse_y - dragging_offset[1]))
-
-        if board.is_in_check(current_player):
-            text_surface = font.render('Check!', True, (255, 0, 0))
-            WINDOW.blit(text_surface, (BOARD_WIDTH // 2 - text_surface.get_width() // 2, 10))
-        
-        # Draw the instructions sidebar
-        draw_instructions(WINDOW, font, current_player, best_move_text)
-
-        pygame.display.update()
-
-        for event in pygame.event.get():
+            squares[square_index(*dragging_piece.position)] = None
+            drag_rect = (mouse_x - dragging_offset[0], mouse_y - dragging_offset[1], SQUARE_SIZE, SQUARE_SIZE)
+        frame = FrameState(tuple(squares), frozenset(valid_moves), drag_rect,
+                           check_rect if status == 'check' else None,
+                           current_player, best_move_text,
+                           metrics.overlay_lines() if SHOW_METRICS else None)
+        rects = dirty_rects(previous_frame, frame)
+        for rect in rects:
+            WINDOW.set_clip(rect)
+            draw_board(WINDOW)
+            draw_pieces(WINDOW, board, exclude_piece=dragging_piece)
+            if valid_moves:
+                highlight_valid_moves(WINDOW, valid_moves)
+            if drag_rect:
+                WINDOW.blit(piece_image(dragging_piece), drag_rect)
+            if frame.check_rect:
+                WINDOW.blit(check_text, frame.check_rect)
+            if rect.colliderect(SIDEBAR_RECT):
+                draw_instructions(WINDOW, font, current_player, best_move_text, frame.metrics_lines)
+        WINDOW.set_clip(None)
+        if rects:
+            pygame.display.update(rects)
+        previous_frame = frame
+        if SHOW_METRICS:
+            metrics.record('frame', time.perf_counter() - frame_start)
+
+        if dragging:
+            clock.tick(DRAG_FPS)
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait()]
+            events.extend(pygame.event.get())
+
+        for event in events:
             if event.type == pygame.QUIT:
                 run = False
 
@@ -779,34 +788,20 @@ def main():
                 pos = pygame.mouse.get_pos()
                 if BEST_MOVE_BUTTON.collidepoint(pos):
                     print("Best Move button clicked")
-                    fen = board.get_fen()
-                    print(f"FEN: {fen}")
-                    try:
-                        response = requests.get('https://lichess.org/api/cloud-eval', params={'fen': fen})
-                        response.raise_for_status()
-                        data = response.json()
-                        if 'pvs' in data and len(data['pvs']) > 0:
-                            best_pv = data['pvs'][0]
-                            best_moves = best_pv['moves']
-                            best_move = best_moves.split(' ')[0]
-                            best_move_text = f"Best move: {best_move}"
-                            print(f"Best move: {best_move}")
-                        else:
-                            best_move_text = "No best move found"
-                            print("No best move found in response:", data)
-                    except requests.exceptions.HTTPError as http_err:
-                        best_move_text = f"HTTP error occurred: {http_err}"
-                        print("HTTP error occurred:", http_err)
-                        print("Response content:", response.content)
-                    except Exception as err:
-                        best_move_text = f"An error occurred: {err}"
-                        print("An error occurred:", err)
+                    print(f"FEN: {board.get_fen()}")
+                    best_move_request = best_move_service.request(board)
+                    best_move_text = "Thinking..."
                 elif RESIGN_BUTTON.collidepoint(pos):
                     print("Resign button clicked")
+                    if journal is not None:
+                        journal.record('end', result='0-1' if current_player == 'w' else '1-0', reason='resignation')
                     game_over = True
                     game_over_popup(f"{'White' if current_player == 'b' else 'Black'} wins by resignation!")
                     board = restart_game()
+                    status = None
+                    best_move_service.cancel()
                     best_move_text = ""
+                    previous_frame = None
 
 
                 row, col = get_row_col_from_mouse(pos)
@@ -827,94 +822,36 @@ def main():
                     pos = pygame.mouse.get_pos()
                     row, col = get_row_col_from_mouse(pos)
                     if (row, col) in valid_moves:
-                        # Determine if the move is a castling move
-                        is_castling = False
-                        castle_type = None  # 'short' or 'long'
-                        from_row, from_col = dragging_piece.position
-                        to_row, to_col = row, col
-
-                        if isinstance(dragging_piece, King) and abs(to_col - from_col) == 2:
-                            is_castling = True
-                            castle_type = 'short' if to_col - from_col == 2 else 'long'
-
-                        if is_castling:
-                            # Define rook movement based on castling type
-                            if castle_type == 'short':
-                                rook_from = (from_row, 7)
-                                rook_to = (from_row, 5)
-                            else:  # 'long'
-                                rook_from = (from_row, 0)
-                                rook_to = (from_row, 3)
-
-                            # Get the rook piece
-                            rook_piece = board.get_piece(*rook_from)
-
-                            # Append both king and rook moves as a list
-                            move_history.append([
-                                {
-                                    'from': (from_row, from_col),
-                                    'to': (to_row, to_col),
-                                    'piece': dragging_piece,
-                                    'captured': board.get_piece(to_row, to_col)
-                                },
-                                {
-                                    'from': rook_from,
-                                    'to': rook_to,
-                                    'piece': rook_piece,
-                                    'captured': board.get_piece(*rook_to)
-                                }
-                            ])
-
-                            # Perform the castling move
-                            promotion, promotion_pos = board.move_piece((from_row, from_col), (to_row, to_col))
-                        else:
-                            # Regular move: append as a list with a single move dictionary
-                            move_history.append([{
-                                'from': dragging_piece.position,
-                                'to': (row, col),
-                                'piece': dragging_piece,
-                                'captured': board.get_piece(row, col)
-                            }])
-                            promotion, promotion_pos = board.move_piece(dragging_piece.position, (row, col))
-
-                        if is_castling:
-                            # Handle castling promotion is not needed
-                            pass
-                        else:
-                            # Check for pawn promotion
-                            if promotion:
-                                handle_promotion(WINDOW, board, promotion_pos)
+                        from_pos = dragging_piece.position
+                        to_pos = (row, col)
+
+                        # Ask for the promotion piece before the pawn moves
+                        promotion = None
+                        if isinstance(dragging_piece, Pawn) and row in (0, ROWS - 1):
+                            promotion = handle_promotion(WINDOW)
+                            previous_frame = None
 
-                        # Reset best move text
+                        move_history.append(board.make_move(from_pos, to_pos, promotion))
+                        if journal is not None:
+                            journal.record('move', move=move_to_uci(decode_move(move_history[-1])))
+
+                        # The position changed: drop any pending suggestion
+                        best_move_service.cancel()
                         best_move_text = ""
 
                         # Check for game over conditions
-                        opponent_color = 'b' if current_player == 'w' else 'w'
-                        opponent_has_moves = False
-                        for r in range(ROWS):
-                            for c in range(COLS):
-                                piece = board.get_piece(r, c)
-                                if piece and piece.color == opponent_color:
-                                    if piece.get_valid_moves((r, c), board):
-                                        opponent_has_moves = True
-                                        break
-                            if opponent_has_moves:
-                                break
-                        if not opponent_has_moves:
-                            if board.is_in_check(opponent_color):
-                                if current_player == "w":
-                                    game_over_popup("White")
-                                    board = restart_game()
-                                else:
-                                    game_over_popup("Black")
-                                    board = restart_game()
-                            else:
-                                game_over_popup("Draw")
-                                board = restart_game()
-
+                        status = board.game_status()
+                        if status is None and TABLEBASES.probe(board) == ('draw', 0):
+                            status = 'draw'  # A known draw ends the game too
+                        if status in GAME_OVER_STATUSES:
+                            board = end_game(board, status)
+                            status = None
                             game_over = True
+                            previous_frame = None
                         else:
-                            current_player = opponent_color
+                            current_player = board.turn
+                            # Have the answer ready before the player asks for it
+                            best_move_service.ponder(board)
                     dragging_piece = None
                     dragging = False
                     valid_moves = []
@@ -922,14 +859,35 @@ def main():
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:
                     board = restart_game()
+                    status = None
+                    best_move_service.cancel()
                     best_move_text = ""
                 elif event.key == pygame.K_u:
                     board = undo_last_move(board)
+                    status = board.game_status()
+                    best_move_service.cancel()
                     best_move_text = ""
-
+                elif event.key == pygame.K_e:
+                    print(f"Game saved to {export_game()}")
+
+            elif event.type == BEST_MOVE_EVENT:
+                if event.request_id == best_move_request:
+                    best_move_text = event.text or "No best move found"
+                    best_move_request = None
+
+    best_move_service.shutdown()
+    if journal is not None:
+        journal.record('exit')
+        journal.close()
+    TABLEBASES.close()
+    ENGINE.close()
+    if SHOW_METRICS:
+        metrics.dump(METRICS_FILE)
+        print(f"Metrics saved to {METRICS_FILE}")
     pygame.quit()
 
 if __name__ == "__main__":
+    open_window()
     pieces_images = load_images()
     if not pieces_images:
         print("Failed to load piece images. Please check the URLs.")
@@ -0,0 +1,145 @@
+"""Client for the lichess cloud evaluation with a two-level response cache.
+
+Answers are cached by normalized FEN (the move clocks are dropped, since
+they do not change the evaluation) first in an in-memory LRU and then in
+an SQLite file, so repeated positions answer instantly and keep working
+offline. Requests go through one pooled requests.Session.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CLOUD_EVAL_URL = 'https://lichess.org/api/cloud-eval'
+
+
+def normalize_fen(fen):
+    """Keep only the placement, side to move, castling and en passant fields."""
+    return ' '.join(fen.split()[:4])
+
+
+class EvalCache:
+    """In-memory LRU in front of an SQLite store, both with a time-to-live.
+
+    `memory_size` bounds the LRU, `max_entries` the database (oldest rows
+    are evicted first) and `ttl` is the age in seconds after which an entry
+    is ignored and removed. `path=None` keeps the cache in memory only.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, path=None, memory_size=512, max_entries=50000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path or ':memory:', check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS evals '
+                             '(fen TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS evals_stored ON evals (stored)')
+            self._db.execute('DELETE FROM evals WHERE stored < ?', (time.time() - self.ttl,))
+            self._db.commit()
+        return self._db
+
+    def get(self, fen):
+        """Return the cached value for a position, or None."""
+        key = normalize_fen(fen)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, stored = entry
+                if now - stored < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            db = self._connect()
+            row = db.execute('SELECT value, stored FROM evals WHERE fen = ?', (key,)).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.disk_hits += 1
+                return value
+            if row is not None:
+                db.execute('DELETE FROM evals WHERE fen = ?', (key,))
+                db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, fen, value):
+        key = normalize_fen(fen)
+        stored = time.time()
+        with self._lock:
+            self._remember(key, value, stored)
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO evals (fen, value, stored) VALUES (?, ?, ?)',
+                       (key, json.dumps(value), stored))
+            excess = db.execute('SELECT COUNT(*) FROM evals').fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute('DELETE FROM evals WHERE fen IN '
+                           '(SELECT fen FROM evals ORDER BY stored LIMIT ?)', (excess,))
+            db.commit()
+
+    def _remember(self, key, value, stored):
+        self._memory[key] = (value, stored)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """Return the hit and miss counters."""
+        return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class CloudEvalClient:
+    """Fetches cloud evaluations through a pooled session, answering from `cache` when it can."""
+
+    def __init__(self, url=CLOUD_EVAL_URL, timeout=5.0, cache=None, pool_size=4):
+        self.url = url
+        self.timeout = timeout
+        self.cache = cache if cache is not None else EvalCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def evaluate(self, fen):
+        """Return the cloud evaluation JSON for a position.
+
+        Raises requests exceptions on network or HTTP errors; those are not cached.
+        """
+        data = self.cache.get(fen)
+        if data is not None:
+            return data
+        response = self.session.get(self.url, params={'fen': fen}, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        self.cache.put(fen, data)
+        return data
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
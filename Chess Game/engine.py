@@ -0,0 +1,262 @@
+"""Built-in chess engine: iterative-deepening alpha-beta search over Board.
+
+The engine only relies on the Board interface (generate_legal_moves,
+make_move/unmake_move, position bitboards and get_fen), so it does not
+import the pygame front-end.
+"""
+import time
+from collections import namedtuple
+
+from chess_core import decode_move, encode_move
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+PIECE_VALUES = {'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 0}
+MATE_SCORE = 100000
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 64
+
+SearchResult = namedtuple('SearchResult', 'move score depth nodes pv seconds')
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the node or time budget runs out."""
+
+
+def evaluate(board):
+    """Score in centipawns from the point of view of the side to move (see Board.evaluate)."""
+    return board.evaluate()
+
+
+def is_mate_score(score):
+    return abs(score) > MATE_SCORE - MAX_PLY
+
+
+def score_to_table(score, ply):
+    """Store mate scores relative to the node rather than the root."""
+    if is_mate_score(score):
+        return score + ply if score > 0 else score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if is_mate_score(score):
+        return score - ply if score > 0 else score + ply
+    return score
+
+
+def format_score(score):
+    """Format a side-to-move score as '+0.35' or 'M3' / '-M2' for mates."""
+    if is_mate_score(score):
+        moves = (MATE_SCORE - abs(score) + 1) // 2
+        return f"M{moves}" if score > 0 else f"-M{moves}"
+    return f"{score / 100:+.2f}"
+
+
+class Engine:
+    """Negamax alpha-beta search with quiescence and move ordering.
+
+    The search stops at `max_depth` plies, or earlier once `max_nodes`
+    nodes have been searched or `max_time` seconds have passed; the result
+    of the last completed iteration is returned.
+
+    Results are kept in a TranspositionTable of `hash_mb` megabytes, or in
+    `table` when one is passed in so several users can share it.
+    """
+
+    def __init__(self, max_depth=4, max_nodes=None, max_time=None, table=None, hash_mb=16):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.table = table if table is not None else TranspositionTable(hash_mb)
+        self.nodes = 0
+        self._deadline = None
+        self._node_limit = None
+        self._stop = None
+        self._pv = [[] for _ in range(MAX_PLY + 1)]
+        self._previous_pv = []
+        self._killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self._history = {}
+
+    def search(self, board, max_depth=None, max_nodes=None, max_time=None, info=None,
+               stop=None, start_depth=1):
+        """Search a copy of `board` and return a SearchResult for the side to move.
+
+        `info`, if given, is called with the SearchResult of every completed
+        iteration. `stop` is an optional threading/multiprocessing Event that
+        ends the search early when set. `start_depth` lets helper searches
+        skip the first iterations.
+        """
+        max_depth = max_depth or self.max_depth
+        max_nodes = max_nodes if max_nodes is not None else self.max_nodes
+        max_time = max_time if max_time is not None else self.max_time
+
+        board = board.copy()
+        self.table.new_search()
+        start = time.perf_counter()
+        self.nodes = 0
+        self._node_limit = max_nodes
+        self._deadline = start + max_time if max_time else None
+        self._stop = stop
+        self._previous_pv = []
+        self._killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self._history = {}
+
+        result = SearchResult(None, 0, 0, 0, [], 0.0)
+        root_moves = board.generate_legal_moves()
+        if not root_moves:
+            score = -MATE_SCORE if board.is_in_check(board.turn) else 0
+            return result._replace(score=score)
+
+        for depth in range(min(start_depth, max_depth), max_depth + 1):
+            try:
+                score = self._negamax(board, depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                break
+            pv = list(self._pv[0])
+            self._previous_pv = pv
+            result = SearchResult(pv[0] if pv else root_moves[0], score, depth, self.nodes, pv,
+                                  time.perf_counter() - start)
+            if info is not None:
+                info(result)
+            if is_mate_score(score):
+                break
+
+        if result.move is None:
+            # Not even depth 1 finished inside the budget
+            result = result._replace(move=root_moves[0], pv=[root_moves[0]])
+        return result._replace(nodes=self.nodes, seconds=time.perf_counter() - start)
+
+    def close(self):
+        """Nothing to release; matches ParallelSearch so either can back the Best Move button."""
+
+    def _count_node(self):
+        self.nodes += 1
+        if self._node_limit is not None and self.nodes > self._node_limit:
+            raise SearchAborted()
+        if not self.nodes & 1023:
+            if self._deadline is not None and time.perf_counter() > self._deadline:
+                raise SearchAborted()
+            if self._stop is not None and self._stop.is_set():
+                raise SearchAborted()
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self._pv[ply] = []
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(board, alpha, beta, ply)
+        self._count_node()
+        if ply and (board.halfmove_clock >= 100 or board.repetition_count()):
+            return 0
+
+        key = board.zobrist_key()
+        hash_move = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            entry_depth, bound, score, move_code = entry
+            if move_code:
+                hash_move = decode_move(move_code)
+            if ply and entry_depth >= depth:
+                score = score_from_table(score, ply)
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        moves = board.generate_legal_moves()
+        if not moves:
+            return -MATE_SCORE + ply if board.is_in_check(board.turn) else 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in self._order_moves(board, moves, ply, hash_move):
+            board.make_move(*move)
+            score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+                self._pv[ply] = [move] + self._pv[ply + 1]
+                if alpha >= beta:
+                    if not self._is_capture(board, move):
+                        self._store_killer(move, ply)
+                        self._history[move] = self._history.get(move, 0) + depth * depth
+                    break
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, bound, score_to_table(best_score, ply), encode_move(best_move))
+        return best_score
+
+    def _quiescence(self, board, alpha, beta, ply):
+        self._count_node()
+        if ply >= MAX_PLY:
+            return evaluate(board)
+        in_check = board.is_in_check(board.turn)
+        moves = board.generate_legal_moves()
+        if not moves:
+            return -MATE_SCORE + ply if in_check else 0
+
+        if not in_check:
+            stand_pat = evaluate(board)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            # Outside of check only captures and promotions are searched
+            moves = [move for move in moves if move[2] or self._is_capture(board, move)]
+
+        for move in self._order_moves(board, moves, ply):
+            board.make_move(*move)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _is_capture(self, board, move):
+        from_pos, to_pos, _ = move
+        if board.position.squares[to_pos[0] * 8 + to_pos[1]] is not None:
+            return True
+        # En passant: a pawn moving diagonally onto an empty square
+        return to_pos == board.en_passant and from_pos[1] != to_pos[1] \
+            and board.position.squares[from_pos[0] * 8 + from_pos[1]] in ('P', 'p')
+
+    def _store_killer(self, move, ply):
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def _order_moves(self, board, moves, ply, hash_move=None):
+        """Sort moves: hash move, previous PV move, captures by MVV-LVA, promotions, killers, history."""
+        squares = board.position.squares
+        pv_move = self._previous_pv[ply] if ply < len(self._previous_pv) else None
+        killers = self._killers[ply]
+        history = self._history
+
+        def score(move):
+            if move == hash_move:
+                return 2000000
+            if move == pv_move:
+                return 1000000
+            from_pos, to_pos, promotion = move
+            victim = squares[to_pos[0] * 8 + to_pos[1]]
+            if victim is not None:
+                attacker = squares[from_pos[0] * 8 + from_pos[1]]
+                return 100000 + PIECE_VALUES[victim.lower()] * 10 - PIECE_VALUES[attacker.lower()] // 10
+            if promotion:
+                return 90000 + PIECE_VALUES[promotion]
+            if move == killers[0]:
+                return 80000
+            if move == killers[1]:
+                return 79000
+            return history.get(move, 0)
+
+        return sorted(moves, key=score, reverse=True)
@@ -0,0 +1,164 @@
+"""Game journal: one JSON line per game event, written by a background thread.
+
+record() only puts a tuple on a queue, so the game loop never waits on the
+disk. The writer thread turns records into lines, flushes at least every
+`flush_interval` seconds and rotates the file once it grows past
+`max_bytes`, keeping `backups` older files (journal.jsonl.1 is the newest).
+Files are appended to, so earlier sessions survive a restart.
+
+Events are 'start' (with the starting FEN), 'move' (UCI), 'undo', 'restart'
+and 'end' (with the result). replay() plays the last game in the journal
+back on a Board, so a game cut short by a crash can be picked up again:
+    python journal.py ~/.cache/chess_game/journal.jsonl --pgn game.pgn
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from chess_core import START_FEN, Board, parse_uci
+from pgn import format_game
+
+_STOP = object()
+
+
+class Journal:
+    """Appends game events to a JSON lines file without blocking the caller."""
+
+    def __init__(self, path, flush_interval=1.0, max_bytes=1 << 20, backups=3):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='journal', daemon=True)
+        self._thread.start()
+
+    def record(self, event, **fields):
+        """Queue one event; `fields` must be JSON-serialisable."""
+        self._queue.put((time.time(), event, fields))
+
+    def close(self):
+        """Write everything still queued and stop the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _rotate(self, journal_file):
+        journal_file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        return open(self.path, 'a', encoding='utf-8')
+
+    def _run(self):
+        journal_file = open(self.path, 'a', encoding='utf-8')
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is not None:
+                    stamp, event, fields = item
+                    journal_file.write(json.dumps({'t': round(stamp, 3), 'event': event, **fields}) + '\n')
+                    if journal_file.tell() >= self.max_bytes:
+                        journal_file = self._rotate(journal_file)
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    journal_file.flush()
+                    last_flush = time.monotonic()
+        finally:
+            journal_file.close()
+
+
+def read_records(path, backups=3):
+    """Yield the records of a journal and its rotated files, oldest first.
+
+    A line cut short by a crash is skipped.
+    """
+    paths = [f"{path}.{number}" for number in range(backups, 0, -1)] + [path]
+    for journal_path in paths:
+        if not os.path.exists(journal_path):
+            continue
+        with open(journal_path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def replay(records):
+    """Rebuild the last game in an iterable of records.
+
+    Returns (start_fen, board, moves, result); result is None for a game
+    that never ended. Raises ValueError if the journal has no game or a
+    move does not fit the position.
+    """
+    game = None
+    for record in records:
+        event = record.get('event')
+        if event in ('start', 'restart'):
+            game = [record.get('fen', START_FEN), [], None]
+        elif game is None:
+            continue
+        elif event == 'move':
+            game[1].append(record['move'])
+        elif event == 'undo' and game[1]:
+            game[1].pop()
+        elif event == 'end':
+            game[2] = record.get('result')
+    if game is None:
+        raise ValueError("No game in the journal")
+
+    fen, uci_moves, result = game
+    board = Board(fen)
+    moves = []
+    for text in uci_moves:
+        move = parse_uci(text)
+        if move not in board.generate_legal_moves():
+            raise ValueError(f"Illegal move {text} in {board.get_fen()}")
+        board.make_move(*move)
+        moves.append(move)
+    return fen, board, moves, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the last game recorded in a journal.")
+    parser.add_argument('journal', help="journal file (rotated copies next to it are read too)")
+    parser.add_argument('--pgn', help="write the game to this PGN file")
+    args = parser.parse_args(argv)
+
+    try:
+        start_fen, board, moves, result = replay(read_records(args.journal))
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print(f"{len(moves)} moves, {'result ' + result if result else 'unfinished'}")
+    print(f"Position: {board.get_fen()}")
+    if args.pgn:
+        with open(args.pgn, 'w', encoding='utf-8') as pgn_file:
+            pgn_file.write(format_game(moves, {'Event': 'Journal replay'}, start_fen, result or '*'))
+        print(f"Game written to {args.pgn}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
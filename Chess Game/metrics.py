@@ -0,0 +1,153 @@
+"""Opt-in counters and timers for the hot paths of the game.
+
+Nothing is measured until enable() is called. enable() wraps the measured
+functions in place: move generation, check tests, engine searches (nodes
+and transposition table hits), the cloud evaluation cache and every HTTP
+request. Until then the original functions run untouched, so the only
+cost of leaving metrics off is the game's SHOW_METRICS test around frame
+timing and the overlay.
+
+The game turns metrics on when started with CHESS_METRICS=1; it then shows
+them in the sidebar and writes them as JSON on exit.
+"""
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+import requests
+
+from chess_core import Board
+from cloud_eval import EvalCache
+from engine import Engine
+from parallel import ParallelSearch
+
+ENABLED = False
+counters = defaultdict(int)
+timers = defaultdict(lambda: [0, 0.0, 0.0])  # calls, total seconds, slowest call
+_patched = []  # (owner, attribute, original) for disable()
+
+
+def count(name, amount=1):
+    counters[name] += amount
+
+
+def record(name, seconds):
+    timer = timers[name]
+    timer[0] += 1
+    timer[1] += seconds
+    if seconds > timer[2]:
+        timer[2] = seconds
+
+
+def timed(name, function):
+    """Wrap `function` so every call is recorded under the timer `name`."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_search(search):
+    @functools.wraps(search)
+    def wrapper(self, *args, **kwargs):
+        # ParallelSearch sums the lookups of its workers; an Engine has its own table
+        table = self if hasattr(self, 'probes') else getattr(self, 'table', None)
+        probes, hits = (table.probes, table.hits) if hasattr(table, 'probes') else (0, 0)
+        start = time.perf_counter()
+        result = search(self, *args, **kwargs)
+        record('search', time.perf_counter() - start)
+        count('search nodes', result.nodes)
+        if hasattr(table, 'probes'):
+            count('tt probes', table.probes - probes)
+            count('tt hits', table.hits - hits)
+        return result
+    return wrapper
+
+
+def _counted_cache_get(get):
+    @functools.wraps(get)
+    def wrapper(self, fen):
+        data = get(self, fen)
+        count('eval cache hits' if data is not None else 'eval cache misses')
+        return data
+    return wrapper
+
+
+def _patch(owner, attribute, wrap):
+    original = getattr(owner, attribute)
+    _patched.append((owner, attribute, original))
+    setattr(owner, attribute, wrap(original))
+
+
+def enable():
+    """Start measuring; calling it again does nothing."""
+    global ENABLED
+    if ENABLED:
+        return
+    ENABLED = True
+    for attribute, name in (('generate_legal_moves', 'move generation'),
+                            ('is_in_check', 'is_in_check'),
+                            ('square_attacked', 'square_attacked')):
+        _patch(Board, attribute, functools.partial(timed, name))
+    _patch(Engine, 'search', _timed_search)
+    _patch(ParallelSearch, 'search', _timed_search)
+    _patch(EvalCache, 'get', _counted_cache_get)
+    _patch(requests.Session, 'request', functools.partial(timed, 'network'))
+
+
+def disable():
+    """Stop measuring and put the original functions back; the numbers are kept."""
+    global ENABLED
+    while _patched:
+        owner, attribute, original = _patched.pop()
+        setattr(owner, attribute, original)
+    ENABLED = False
+
+
+def reset():
+    counters.clear()
+    timers.clear()
+
+
+def snapshot():
+    """Return the current numbers as a JSON-friendly dict."""
+    return {
+        'counters': dict(counters),
+        'timers': {name: {'calls': calls, 'total_ms': round(total * 1000, 3),
+                          'mean_ms': round(total * 1000 / calls, 4) if calls else 0.0,
+                          'max_ms': round(slowest * 1000, 3)}
+                   for name, (calls, total, slowest) in timers.items()},
+    }
+
+
+def dump(path):
+    """Write snapshot() to `path` as JSON."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as metrics_file:
+        json.dump(snapshot(), metrics_file, indent=2, sort_keys=True)
+
+
+def _mean_ms(name):
+    calls, total, _ = timers.get(name, (0, 0.0, 0.0))
+    return total * 1000 / calls if calls else 0.0
+
+
+def overlay_lines():
+    """Return a few short lines summing up the numbers, for the sidebar."""
+    probes = counters.get('tt probes', 0)
+    lookups = counters.get('eval cache hits', 0) + counters.get('eval cache misses', 0)
+    return (
+        f"movegen {timers['move generation'][0] if 'move generation' in timers else 0} "
+        f"({_mean_ms('move generation'):.2f} ms)",
+        f"checks {sum(timers[name][0] for name in ('is_in_check', 'square_attacked') if name in timers)}",
+        f"nodes {counters.get('search nodes', 0)}, "
+        f"TT {counters.get('tt hits', 0) / probes if probes else 0:.0%}, "
+        f"cache {counters.get('eval cache hits', 0)}/{lookups}",
+        f"frame {_mean_ms('frame'):.1f} ms, net {_mean_ms('network'):.0f} ms",
+    )
@@ -0,0 +1,154 @@
+"""Lazy SMP: several engine processes search the same position and share
+one transposition table in shared memory.
+
+Every worker runs the normal iterative-deepening search; odd-numbered
+helpers start one ply deeper so the workers spread over depths and fill
+the table with results the others pick up. When worker 0 finishes, the
+helpers are told to stop, and the deepest completed result wins (ties go
+to the lowest worker id), so a fixed-depth search always answers with the
+same depth.
+
+Measure how nodes/second scales with the number of workers:
+    python parallel.py --depth 5 --workers 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from multiprocessing import shared_memory
+
+from chess_core import START_FEN, Board, move_to_uci
+from engine import Engine, format_score
+from transposition import ENTRY_BYTES, TranspositionTable, table_entries
+
+_worker = {}  # State of the current worker process, set up by _init_worker
+
+
+def _init_worker(shm_name, hash_mb, board_class, stop):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['engine'] = Engine(table=TranspositionTable(hash_mb, shm.buf))
+    _worker['board_class'] = board_class
+    _worker['stop'] = stop
+
+
+def _search_job(fen, key_history, worker_id, max_depth, max_nodes, max_time):
+    board = _worker['board_class'](fen)
+    board.key_history = array('Q', key_history)
+    table = _worker['engine'].table
+    probes, hits = table.probes, table.hits
+    result = _worker['engine'].search(board, max_depth, max_nodes, max_time,
+                                      stop=_worker['stop'], start_depth=1 + worker_id % 2)
+    return worker_id, result, table.probes - probes, table.hits - hits
+
+
+class ParallelSearch:
+    """Drop-in replacement for Engine that searches with a pool of worker processes.
+
+    The pool and the shared table are created on the first search and live
+    until close(). `hash_mb` sizes the shared table. `probes` and `hits`
+    add up the table lookups of all workers over every search.
+    """
+
+    def __init__(self, workers=None, max_depth=4, max_nodes=None, max_time=None, hash_mb=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.hash_mb = hash_mb
+        self.table = None
+        self.probes = 0
+        self.hits = 0
+        self._pool = None
+        self._shm = None
+        self._stop = None
+
+    def _start(self, board_class):
+        # The game starts the pool from a worker thread while SDL and the
+        # journal thread run; forking that process is not safe
+        context = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=table_entries(self.hash_mb) * ENTRY_BYTES)
+        self.table = TranspositionTable(self.hash_mb, self._shm.buf)
+        self.table.clear()
+        self._stop = context.Event()
+        self._pool = context.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(self._shm.name, self.hash_mb, board_class, self._stop))
+
+    def search(self, board, max_depth=None, max_nodes=None, max_time=None, stop=None):
+        """Search `board` on all workers and return the combined SearchResult.
+
+        `nodes` in the result is the total over all workers. `stop` is an
+        optional threading Event that ends the search early when set.
+        """
+        if self._pool is None:
+            self._start(type(board))
+        max_depth = max_depth or self.max_depth
+        max_nodes = max_nodes if max_nodes is not None else self.max_nodes
+        max_time = max_time if max_time is not None else self.max_time
+
+        start = time.perf_counter()
+        self._stop.clear()
+        fen = board.get_fen()
+        history = list(board.key_history)
+        pending = [
+            self._pool.apply_async(_search_job, (fen, history, worker_id, max_depth, max_nodes, max_time))
+            for worker_id in range(self.workers)
+        ]
+        while not pending[0].ready():
+            pending[0].wait(0.05)
+            if stop is not None and stop.is_set():
+                self._stop.set()
+        results = [pending[0].get()]
+        self._stop.set()
+        results.extend(job.get() for job in pending[1:])
+        self._stop.clear()
+
+        _, best, _, _ = max(results, key=lambda item: (item[1].move is not None, item[1].depth, -item[0]))
+        nodes = sum(result.nodes for _, result, _, _ in results)
+        self.probes += sum(probes for _, _, probes, _ in results)
+        self.hits += sum(hits for _, _, _, hits in results)
+        return best._replace(nodes=nodes, seconds=time.perf_counter() - start)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shm is not None:
+            self.table.release()
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure parallel search scaling.")
+    parser.add_argument('--fen', help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=5, help="search depth in plies")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument('--hash', type=int, default=64, help="shared table size in MB")
+    args = parser.parse_args(argv)
+
+    fen = args.fen or START_FEN
+    baseline = None
+    print(f"{'workers':>7} {'move':>6} {'score':>7} {'nodes':>9} {'time':>8} {'nodes/s':>9} {'speedup':>7}")
+    for workers in args.workers:
+        with ParallelSearch(workers, max_depth=args.depth, hash_mb=args.hash) as search:
+            result = search.search(Board(fen))
+        nps = result.nodes / result.seconds if result.seconds else 0
+        baseline = baseline or nps
+        print(f"{workers:>7} {move_to_uci(result.move):>6} {format_score(result.score):>7} {result.nodes:>9} "
+              f"{result.seconds:>7.2f}s {nps:>9,.0f} {nps / baseline:>6.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
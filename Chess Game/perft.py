@@ -0,0 +1,147 @@
+"""Perft: count leaf nodes of the legal move tree to check and time move generation.
+
+Run a single position:
+    python perft.py --fen "<fen>" --depth 4 --divide
+
+Run the reference suite (exits with status 1 if any count is wrong):
+    python perft.py --suite --depth 3
+"""
+import argparse
+import sys
+import time
+
+from chess_core import Board, Pawn, ROWS, COLS, PROMOTION_CHOICES, START_FEN, move_to_uci
+
+# Published node counts (https://www.chessprogramming.org/Perft_Results), by depth from 1.
+REFERENCE_POSITIONS = [
+    ('startpos', START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def piece_moves(board):
+    """Legal moves collected piece by piece through Piece.get_valid_moves, as the UI does."""
+    moves = []
+    for row in range(ROWS):
+        for col in range(COLS):
+            piece = board.get_piece(row, col)
+            if piece is None or piece.color != board.turn:
+                continue
+            for to_pos in piece.get_valid_moves((row, col), board):
+                if isinstance(piece, Pawn) and to_pos[0] in (0, ROWS - 1):
+                    moves.extend(((row, col), to_pos, promotion) for promotion in PROMOTION_CHOICES)
+                else:
+                    moves.append(((row, col), to_pos, None))
+    return moves
+
+
+def board_moves(board):
+    """Legal moves from Board.generate_legal_moves."""
+    return board.generate_legal_moves()
+
+
+# Move generators perft can run against, by name
+BACKENDS = {
+    'board': board_moves,
+    'pieces': piece_moves,
+}
+
+
+def perft(board, depth, generate=board_moves):
+    """Count the leaf nodes `depth` plies below the current position."""
+    moves = generate(board)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        board.make_move(*move)
+        nodes += perft(board, depth - 1, generate)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board, depth, generate=board_moves):
+    """Return the perft count below each root move, keyed by its UCI string."""
+    counts = {}
+    for move in generate(board):
+        board.make_move(*move)
+        counts[move_to_uci(move)] = perft(board, depth - 1, generate)
+        board.unmake_move()
+    return counts
+
+
+def timed_perft(fen, depth, generate=board_moves):
+    """Run perft on a FEN and return (nodes, seconds)."""
+    board = Board(fen)
+    start = time.perf_counter()
+    nodes = perft(board, depth, generate)
+    return nodes, time.perf_counter() - start
+
+
+def format_result(depth, nodes, seconds):
+    nps = nodes / seconds if seconds > 0 else 0
+    return f"depth {depth}: {nodes} nodes in {seconds:.3f}s ({nps:,.0f} nodes/s)"
+
+
+def run_suite(max_depth, generate=board_moves, max_nodes=None):
+    """Check every reference position up to `max_depth`; return the number of mismatches."""
+    failures = 0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        print(f"{name}: {fen}")
+        for depth, expected in enumerate(expected_counts[:max_depth], start=1):
+            if max_nodes is not None and expected > max_nodes:
+                break
+            nodes, seconds = timed_perft(fen, depth, generate)
+            status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+            print(f"  {format_result(depth, nodes, seconds)} {status}")
+            if nodes != expected:
+                failures += 1
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time legal move generation.")
+    parser.add_argument('--fen', default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument('--depth', type=int, default=3, help="search depth in plies")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='board',
+                        help="move generator to run against")
+    parser.add_argument('--divide', action='store_true', help="print the count below each root move")
+    parser.add_argument('--suite', action='store_true', help="check the reference positions instead")
+    parser.add_argument('--max-nodes', type=int, help="skip suite depths with more reference nodes than this")
+    args = parser.parse_args(argv)
+
+    generate = BACKENDS[args.backend]
+
+    if args.suite:
+        failures = run_suite(args.depth, generate, args.max_nodes)
+        print("All counts match." if not failures else f"{failures} count(s) did not match.")
+        return 1 if failures else 0
+
+    if args.divide:
+        board = Board(args.fen)
+        start = time.perf_counter()
+        counts = divide(board, args.depth, generate)
+        for move, nodes in sorted(counts.items()):
+            print(f"{move}: {nodes}")
+        print(f"moves: {len(counts)}")
+        print(format_result(args.depth, sum(counts.values()), time.perf_counter() - start))
+        return 0
+
+    for depth in range(1, args.depth + 1):
+        nodes, seconds = timed_perft(args.fen, depth, generate)
+        print(format_result(depth, nodes, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Reading and writing games in PGN, with SAN moves resolved on the Board.
+
+read_games() streams a PGN file one game at a time, so memory use does not
+depend on the size of the file. Moves are kept as SAN text until a game is
+replayed, which lets a large archive be scanned for headers quickly.
+
+Count and check every game in a file:
+    python pgn.py games.pgn --replay
+"""
+import argparse
+import re
+import sys
+import time
+from collections import namedtuple
+
+from chess_core import START_FEN, Board, parse_square, square_name
+
+Game = namedtuple('Game', 'headers moves result')
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+_HEADER = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_UNESCAPE = re.compile(r'\\(.)')
+_TOKEN = re.compile(r'''
+    \{[^}]*\}?           # comment
+  | ;[^\n]*              # rest-of-line comment
+  | \$\d+                # numeric annotation glyph
+  | [()]                 # start or end of a variation
+  | 1-0 | 0-1 | 1/2-1/2 | \*
+  | \d+\.+               # move number
+  | [^\s{}();$]+         # move
+''', re.VERBOSE)
+_SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?[+#]?[!?]*$')
+_CASTLING = re.compile(r'([O0]-[O0](?:-[O0])?)[+#]?[!?]*$')
+
+
+class PGNError(ValueError):
+    """Raised for a move that is illegal or ambiguous in its position."""
+
+
+def parse_movetext(text):
+    """Return (moves, result) from PGN movetext, skipping comments, NAGs and variations."""
+    moves = []
+    result = '*'
+    depth = 0
+    for token in _TOKEN.findall(text):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth = max(depth - 1, 0)
+        elif depth or first in '{;$' or token[-1] == '.':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return moves, result
+
+
+def read_games(lines):
+    """Yield a Game for every game in an iterable of PGN lines (e.g. an open file)."""
+    headers = {}
+    movetext = []
+    for line in lines:
+        if line.startswith('['):
+            if movetext:
+                yield Game(headers, *parse_movetext(''.join(movetext)))
+                headers, movetext = {}, []
+            match = _HEADER.match(line)
+            if match:
+                headers[match.group(1)] = _UNESCAPE.sub(r'\1', match.group(2))
+        elif line.startswith('%'):
+            continue  # Escaped line
+        elif line.strip() or movetext:
+            movetext.append(line)
+    if headers or movetext:
+        yield Game(headers, *parse_movetext(''.join(movetext)))
+
+
+def parse_san(board, san, legal_moves=None):
+    """Return the (from_pos, to_pos, promotion) move written `san` on `board`."""
+    if legal_moves is None:
+        legal_moves = board.generate_legal_moves()
+    squares = board.position.squares
+
+    castling = _CASTLING.match(san)
+    if castling:
+        row = 7 if board.turn == 'w' else 0
+        to_col = 2 if len(castling.group(1)) == 5 else 6
+        candidates = [move for move in legal_moves
+                      if move[0] == (row, 4) and move[1] == (row, to_col)
+                      and squares[row * 8 + 4] in ('K', 'k')]
+    else:
+        match = _SAN.match(san)
+        if not match:
+            raise PGNError(f"Not a SAN move: {san}")
+        piece, from_file, from_rank, target, promotion = match.groups()
+        piece = piece or 'P'
+        to_pos = parse_square(target)
+        from_col = 'abcdefgh'.index(from_file) if from_file else None
+        from_row = 8 - int(from_rank) if from_rank else None
+        promotion = promotion.lower() if promotion else None
+        candidates = [move for move in legal_moves
+                      if move[1] == to_pos and move[2] == promotion
+                      and squares[move[0][0] * 8 + move[0][1]].upper() == piece
+                      and (from_col is None or move[0][1] == from_col)
+                      and (from_row is None or move[0][0] == from_row)]
+
+    if len(candidates) != 1:
+        problem = 'Illegal' if not candidates else 'Ambiguous'
+        raise PGNError(f"{problem} move {san} in {board.get_fen()}")
+    return candidates[0]
+
+
+def move_to_san(board, move, legal_moves=None):
+    """Return the SAN text ('Nbd7', 'exd8=Q+', 'O-O') of a legal move on `board`."""
+    if legal_moves is None:
+        legal_moves = board.generate_legal_moves()
+    squares = board.position.squares
+    (fr, fc), (tr, tc), promotion = move
+    piece = squares[fr * 8 + fc].upper()
+
+    if piece == 'K' and abs(tc - fc) == 2:
+        san = 'O-O' if tc > fc else 'O-O-O'
+    else:
+        capture = squares[tr * 8 + tc] is not None or (piece == 'P' and fc != tc)
+        if piece == 'P':
+            san = ('abcdefgh'[fc] + 'x' if capture else '') + square_name((tr, tc))
+            if promotion:
+                san += '=' + promotion.upper()
+        else:
+            rivals = [other[0] for other in legal_moves
+                      if other[1] == (tr, tc) and other[0] != (fr, fc)
+                      and squares[other[0][0] * 8 + other[0][1]].upper() == piece]
+            hint = ''
+            if rivals:
+                if all(col != fc for _, col in rivals):
+                    hint = 'abcdefgh'[fc]
+                elif all(row != fr for row, _ in rivals):
+                    hint = str(8 - fr)
+                else:
+                    hint = square_name((fr, fc))
+            san = piece + hint + ('x' if capture else '') + square_name((tr, tc))
+
+    board.make_move(*move)
+    if board.is_in_check(board.turn):
+        san += '#' if not board.generate_legal_moves() else '+'
+    board.unmake_move()
+    return san
+
+
+def start_board(headers):
+    """Return the Board a game starts from, honouring a FEN header."""
+    return Board(headers.get('FEN', START_FEN))
+
+
+def replay(game):
+    """Play a Game's moves on a new Board; return the board and the list of moves.
+
+    Raises PGNError at the first move that cannot be played.
+    """
+    board = start_board(game.headers)
+    moves = []
+    for san in game.moves:
+        move = parse_san(board, san)
+        board.make_move(*move)
+        moves.append(move)
+    return board, moves
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def format_game(moves, headers=None, fen=None, result='*'):
+    """Return PGN text for a list of (from_pos, to_pos, promotion) moves.
+
+    `headers` adds to or overrides the seven-tag roster; `fen` is the
+    starting position when it is not the standard one.
+    """
+    tags = {'Event': '?', 'Site': '?', 'Date': '????.??.??', 'Round': '?', 'White': '?', 'Black': '?'}
+    tags.update(headers or {})
+    tags['Result'] = result
+    if fen and fen != START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = fen
+    ordered = list(SEVEN_TAG_ROSTER) + [tag for tag in tags if tag not in SEVEN_TAG_ROSTER]
+    lines = [f'[{tag} "{_escape(tags[tag])}"]' for tag in ordered]
+    lines.append('')
+
+    board = Board(fen or START_FEN)
+    words = []
+    for move in moves:
+        if board.turn == 'w':
+            words.append(f"{board.fullmove_number}.")
+        elif not words:
+            words.append(f"{board.fullmove_number}...")
+        words.append(move_to_san(board, move))
+        board.make_move(*move)
+    words.append(result)
+
+    line = ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > 79:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read PGN files and check their moves.")
+    parser.add_argument('files', nargs='+', help="PGN files to read")
+    parser.add_argument('--replay', action='store_true', help="play every move on the board, not just parse")
+    args = parser.parse_args(argv)
+
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for path in args.files:
+        with open(path, encoding='utf-8', errors='replace') as pgn_file:
+            for game in read_games(pgn_file):
+                games += 1
+                plies += len(game.moves)
+                if args.replay:
+                    try:
+                        replay(game)
+                    except PGNError as error:
+                        errors += 1
+                        print(f"{path}: game {games}: {error}", file=sys.stderr)
+    seconds = time.perf_counter() - start
+    rate = games / seconds if seconds else 0
+    print(f"{games} games, {plies} plies in {seconds:.2f}s ({rate:,.0f} games/s)")
+    if args.replay:
+        print("All moves legal." if not errors else f"{errors} game(s) with bad moves.")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""Asyncio game server: many games at once, one JSON object per line over TCP.
+
+    python server.py serve --port 8765
+    python server.py loadtest --clients 200 --moves 10
+
+A client sends requests such as
+    {"op": "new", "engine": "b", "depth": 2}
+    {"op": "move", "game": 1, "move": "e2e4"}
+    {"op": "state", "game": 1}
+    {"op": "close", "game": 1}
+    {"op": "stats"}
+and gets one reply line for each, echoing the request's "id" if it had one.
+Game replies carry the FEN, the status ('check', 'checkmate', 'stalemate',
+'draw' or null), the result, the legal moves and, when the engine moved,
+its "reply" in UCI.
+
+Sessions only hold a FEN, the position keys for repetitions and the move
+list. Move validation and engine replies run in a pool of worker
+processes, so a slow search never holds up the other games. The event
+loop keeps the last request latencies of every operation and reports
+their percentiles in 'stats'. Games opened on a connection are closed
+when it drops. Only the connection that opened a game may move in it or
+close it; any connection may ask for its state.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_core import START_FEN, Board, move_to_uci, parse_uci
+from engine import Engine
+
+DEFAULT_PORT = 8765
+LATENCY_SAMPLES = 10000  # Latencies kept per operation for the percentiles
+PERCENTILES = (50, 90, 99)
+
+_engines = {}  # Engines of the current worker process, by depth
+
+
+def _engine(depth):
+    engine = _engines.get(depth)
+    if engine is None:
+        engine = _engines[depth] = Engine(max_depth=depth, hash_mb=8)
+    return engine
+
+
+def _summary(board, legal):
+    status = result = None
+    in_check = board.is_in_check(board.turn)
+    if not legal:
+        status = 'checkmate' if in_check else 'stalemate'
+        result = ('0-1' if board.turn == 'w' else '1-0') if in_check else '1/2-1/2'
+    elif board.repetition_count() >= 2 or board.halfmove_clock >= 100 or board.insufficient_material():
+        status, result = 'draw', '1/2-1/2'
+    elif in_check:
+        status = 'check'
+    return {'fen': board.get_fen(), 'keys': board.key_history.tolist(), 'status': status,
+            'result': result, 'turn': board.turn, 'legal': [move_to_uci(move) for move in legal]}
+
+
+def play(fen, keys, move, engine_depth=None):
+    """Play `move` (UCI, or None for no move) and then an engine reply if `engine_depth` is set.
+
+    Runs in a worker process. Returns the new game summary, with 'reply'
+    when the engine moved, or {'error': ...} for an illegal move.
+    """
+    board = Board(fen)
+    board.key_history = array('Q', keys)
+    legal = board.generate_legal_moves()
+    if move is not None:
+        try:
+            parsed = parse_uci(move)
+        except ValueError as error:
+            return {'error': str(error)}
+        if parsed not in legal:
+            return {'error': f"Illegal move {move}"}
+        board.make_move(*parsed)
+        legal = board.generate_legal_moves()
+    summary = _summary(board, legal)
+    if engine_depth and summary['result'] is None:
+        reply = _engine(engine_depth).search(board).move
+        board.make_move(*reply)
+        summary = _summary(board, board.generate_legal_moves())
+        summary['reply'] = move_to_uci(reply)
+    return summary
+
+
+def percentiles(samples, points=PERCENTILES):
+    """Return {'p50': ..., ...} in milliseconds for a list of latencies in seconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {f"p{point}": round(ordered[min(len(ordered) - 1, len(ordered) * point // 100)] * 1000, 2)
+            for point in points}
+
+
+class GameSession:
+    """State of one game on the server."""
+
+    def __init__(self, game_id, fen, engine_color, engine_depth, owner):
+        self.id = game_id
+        self.fen = fen
+        self.keys = []
+        self.moves = []
+        self.status = None
+        self.result = None
+        self.turn = fen.split()[1] if len(fen.split()) > 1 else 'w'
+        self.legal = []
+        self.engine_color = engine_color
+        self.engine_depth = engine_depth
+        self.owner = owner
+        self.lock = asyncio.Lock()  # One move at a time per game
+
+    def update(self, summary, move=None):
+        for name in ('fen', 'keys', 'status', 'result', 'turn', 'legal'):
+            setattr(self, name, summary[name])
+        self.moves.extend(played for played in (move, summary.get('reply')) if played)
+
+    def describe(self):
+        return {'game': self.id, 'fen': self.fen, 'status': self.status, 'result': self.result,
+                'turn': self.turn, 'moves': len(self.moves), 'legal': self.legal}
+
+
+class GameServer:
+    """Hosts the game sessions and answers requests from any number of connections."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.sessions = {}
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+        self._ids = itertools.count(1)
+        self._server = None
+        self._connections = {}  # Handler task -> writer of every open connection
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        # Forked workers would inherit the sockets of open connections and
+        # keep them alive after the server closes them
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        await asyncio.gather(*(self._run(START_FEN, [], None) for _ in range(self.workers)))
+        self._server = await asyncio.start_server(self._connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Closing the connections lets their handlers finish on their own
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+        if self.pool is not None:
+            if sys.version_info >= (3, 9):
+                self.pool.shutdown(cancel_futures=True)
+            else:
+                self.pool.shutdown()
+
+    async def _run(self, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, play, *args)
+
+    async def _connection(self, reader, writer):
+        owner = object()
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    op = request.get('op')
+                    reply = await self.handle(request, owner)
+                except (ValueError, AttributeError, TypeError, KeyError):
+                    op, request, reply = 'invalid', {}, {'ok': False, 'error': "Bad request"}
+                if isinstance(request, dict) and 'id' in request:
+                    reply['id'] = request['id']
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+                self.latencies[op].append(time.perf_counter() - start)
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in [game_id for game_id, session in self.sessions.items() if session.owner is owner]:
+                del self.sessions[game_id]
+            del self._connections[task]
+            writer.close()
+
+    async def handle(self, request, owner=None):
+        """Answer one request dict with a reply dict."""
+        op = request.get('op')
+        if op == 'new':
+            return await self._new(request, owner)
+        if op == 'stats':
+            return {'ok': True, 'games': len(self.sessions),
+                    'latency_ms': {name: percentiles(samples) for name, samples in self.latencies.items()}}
+        session = self.sessions.get(request.get('game'))
+        if session is None:
+            return {'ok': False, 'error': "Unknown game"}
+        if op in ('move', 'close') and session.owner is not owner:
+            return {'ok': False, 'error': "Not your game"}
+        if op == 'move':
+            return await self._move(session, request.get('move'))
+        if op == 'state':
+            return {'ok': True, **session.describe()}
+        if op == 'close':
+            del self.sessions[session.id]
+            return {'ok': True, 'game': session.id}
+        return {'ok': False, 'error': f"Unknown op {op}"}
+
+    async def _new(self, request, owner):
+        fen = request.get('fen') or START_FEN
+        engine_color = request.get('engine')
+        if engine_color not in (None, 'w', 'b'):
+            return {'ok': False, 'error': "engine must be 'w', 'b' or null"}
+        session = GameSession(None, fen, engine_color, int(request.get('depth', 2)), owner)
+        try:
+            summary = await self._run(fen, [], None, session.engine_depth if session.turn == engine_color else None)
+        except ValueError as error:
+            return {'ok': False, 'error': str(error)}
+        session.update(summary)
+        session.id = next(self._ids)
+        self.sessions[session.id] = session
+        return {'ok': True, **session.describe(), **({'reply': summary['reply']} if 'reply' in summary else {})}
+
+    async def _move(self, session, move):
+        async with session.lock:
+            if session.result is not None:
+                return {'ok': False, 'error': "Game over", **session.describe()}
+            if session.turn == session.engine_color:
+                return {'ok': False, 'error': "Not your turn"}
+            if not isinstance(move, str):
+                return {'ok': False, 'error': "A move is needed"}
+            depth = session.engine_depth if session.engine_color else None
+            summary = await self._run(session.fen, session.keys, move, depth)
+            if 'error' in summary:
+                return {'ok': False, 'error': summary['error']}
+            session.update(summary, move)
+            reply = {'ok': True, **session.describe()}
+            if 'reply' in summary:
+                reply['reply'] = summary['reply']
+            return reply
+
+
+async def _client_game(host, port, moves, depth, rng, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def call(request):
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        return reply
+
+    played = 0
+    state = await call({'op': 'new', 'engine': 'b', 'depth': depth})
+    game = state['game']
+    while played < moves and state.get('legal') and state.get('result') is None:
+        state = await call({'op': 'move', 'game': game, 'move': rng.choice(state['legal'])})
+        played += 1
+    await call({'op': 'close', 'game': game})
+    writer.close()
+    await writer.wait_closed()
+    return played
+
+
+async def load_test(clients, moves, depth, host='127.0.0.1', port=None, workers=None, seed=1):
+    """Play `clients` simulated games at once against a server and print the latencies.
+
+    Without `port` a server is started in this process for the test.
+    """
+    server = None
+    if port is None:
+        server = GameServer(workers)
+        port = await server.start(host, 0)
+    latencies = []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    try:
+        played = await asyncio.gather(*(_client_game(host, port, moves, depth, random.Random(rng.random()), latencies)
+                                        for _ in range(clients)))
+        seconds = time.perf_counter() - start
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(b'{"op": "stats"}\n')
+        stats = json.loads(await reader.readline())
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        if server is not None:
+            await server.close()
+    total = sum(played)
+    print(f"{clients} clients, {total} moves in {seconds:.2f}s ({total / seconds:,.1f} moves/s)")
+    print(f"round trip: {percentiles(latencies)}")
+    for op, values in sorted(stats['latency_ms'].items()):
+        print(f"server {op}: {values}")
+    return stats
+
+
+async def serve(host, port, workers, report_interval):
+    server = GameServer(workers)
+    port = await server.start(host, port)
+    print(f"Serving on {host}:{port} with {server.workers} workers")
+    try:
+        while True:
+            await asyncio.sleep(report_interval)
+            stats = await server.handle({'op': 'stats'})
+            print(f"{stats['games']} games, latency ms: {stats['latency_ms']}")
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many games over a JSON-lines TCP protocol.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('serve', help="run the server")
+    run.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    run.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on")
+    run.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    run.add_argument('--report', type=float, default=30.0, help="seconds between latency reports")
+    test = commands.add_parser('loadtest', help="play simulated clients against a server")
+    test.add_argument('--clients', type=int, default=100, help="games played at once")
+    test.add_argument('--moves', type=int, default=10, help="moves each client plays")
+    test.add_argument('--depth', type=int, default=1, help="engine depth of the replies")
+    test.add_argument('--host', default='127.0.0.1', help="server address")
+    test.add_argument('--port', type=int, help="server port (default: start a server for the test)")
+    test.add_argument('--workers', type=int, help="worker processes of the test server")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(serve(args.host, args.port, args.workers, args.report))
+        else:
+            asyncio.run(load_test(args.clients, args.moves, args.depth, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,419 @@
+"""Endgame tablebases built locally by retrograde analysis.
+
+A table covers one material set where the stronger side has its king and
+one piece, or two minor pieces, against a bare king: KQK, KRK, KBK, KNK,
+KPK, KBNK, KBBK, KNNK. It is built with the strong side as White and
+answers for either colour by mirroring the board.
+
+Each table is a file of one byte per position, indexed by side to move
+and the squares of the white king, the white pieces and the black king.
+0 is a draw, 255 an impossible position and any other value v means the
+side to move mates (White) or is mated (Black) in v - 1 plies. A byte
+rather than a two-bit win/draw/loss code, because the distance is what
+lets the best move take the shortest mate. Files only store positions
+with the white king in one part of the board; the rest are found by
+mirroring: the a1-d1-d4 triangle for tables without pawns (an eighth of
+the board) and the a-d files with pawns (a half). Impossible placements
+keep their slot so an index is plain arithmetic. Files are memory-mapped
+for probing, so loading them costs nothing.
+
+Generation starts from the mates and walks backwards: a White position
+is won as soon as one move reaches a lost Black position, and a Black
+position is lost once every one of its moves reaches a won White one.
+Positions are finished in order of distance, so distances are exact.
+
+Generate tables (every set in its own process) and probe a position:
+    python tablebase.py generate KQK KRK KPK --dir tablebases
+    python tablebase.py probe --fen "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1"
+
+Pawnless four-piece sets such as KBNK have 33 million positions (a 5 MB
+file once folded) and take a long time in pure Python.
+"""
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_core import KING_ATTACKS, Board, iter_squares, move_to_uci, piece_attacks
+
+PIECE_ORDER = 'QRBNP'
+SUPPORTED = ('KQK', 'KRK', 'KBK', 'KNK', 'KPK', 'KBNK', 'KBBK', 'KNNK')
+DRAW, ILLEGAL = 0, 255
+# Promotions from a pawn table land in these tables
+PROMOTION_TABLES = {'q': 'KQK', 'r': 'KRK', 'b': 'KBK', 'n': 'KNK'}
+
+
+def table_pieces(name):
+    """Return the white piece letters of a table name ('KBNK' -> ['K', 'B', 'N'])."""
+    if name not in SUPPORTED:
+        raise ValueError(f"Unsupported material set: {name}")
+    return list(name[:-1])
+
+
+def _transform(square, flip_file, flip_rank, transpose):
+    if flip_file:
+        square ^= 7
+    if flip_rank:
+        square ^= 56
+    if transpose:  # Mirror in the a1-h8 diagonal
+        row, col = divmod(square, 8)
+        square = (7 - col) * 8 + (7 - row)
+    return square
+
+
+def _symmetries(pawns):
+    """Return (square maps by white king square, slot of each stored king square).
+
+    Each map moves the white king into the stored part of the board; pawns
+    only allow mirroring the files.
+    """
+    maps = []
+    for king in range(64):
+        flip_file = king % 8 > 3
+        flip_rank = not pawns and king // 8 < 4
+        row, col = divmod(_transform(king, flip_file, flip_rank, False), 8)
+        transpose = not pawns and col < 7 - row
+        maps.append(bytes(_transform(square, flip_file, flip_rank, transpose) for square in range(64)))
+    stored = sorted({maps[king][king] for king in range(64)})
+    return maps, {square: slot for slot, square in enumerate(stored)}
+
+
+SYMMETRIES = {False: _symmetries(False), True: _symmetries(True)}  # By whether the table has pawns
+
+
+def table_size(name):
+    _, slots = SYMMETRIES['P' in name]
+    return 2 * len(slots) * 64 ** (len(name) - 1)
+
+
+def _index(black_to_move, squares):
+    index = black_to_move
+    for square in squares:
+        index = index * 64 + square
+    return index
+
+
+def _stored_index(name, black_to_move, squares):
+    """Return the offset of a position in the file of table `name`."""
+    maps, slots = SYMMETRIES['P' in name]
+    mapping = maps[squares[0]]
+    index = black_to_move * len(slots) + slots[mapping[squares[0]]]
+    for square in squares[1:]:
+        index = index * 64 + mapping[square]
+    return index
+
+
+def _white_attacks(pieces, squares, occupancy):
+    attacks = 0
+    for name, square in zip(pieces, squares):
+        attacks |= piece_attacks(name, square, occupancy)
+    return attacks
+
+
+def _placement_is_legal(pieces, squares):
+    """Distinct squares, kings apart and no pawn on the first or last rank."""
+    if len(set(squares)) != len(squares):
+        return False
+    if KING_ATTACKS[squares[0]] >> squares[-1] & 1:
+        return False
+    return all(name != 'P' or 8 <= square < 56 for name, square in zip(pieces, squares))
+
+
+def generate(name, directory, log=print):
+    """Build the table for `name` and write it to `directory`; return the file path.
+
+    Pawn tables need the tables their promotions lead to; missing KBK or
+    KNK tables count as draws.
+    """
+    pieces = table_pieces(name)
+    count = len(pieces)  # White pieces, the black king comes last
+    half = 64 ** (count + 1)
+    values = bytearray(2 * half)
+    # Black positions: legal king moves that stay in the table, or ILLEGAL
+    # when the king can capture and reach a drawn ending instead
+    moves_left = bytearray(2 * half)
+    layers = {}
+    start = time.perf_counter()
+
+    promotion_tables = {}
+    if 'P' in pieces:
+        for letter, table in PROMOTION_TABLES.items():
+            path = os.path.join(directory, table + '.tb')
+            if os.path.exists(path) and os.path.getsize(path) == table_size(table):
+                with open(path, 'rb') as table_file:
+                    promotion_tables[letter] = table_file.read()
+
+    for squares in itertools.product(range(64), repeat=count + 1):
+        white_index = _index(0, squares)
+        black_index = white_index + half
+        if not _placement_is_legal(pieces, squares):
+            values[white_index] = values[black_index] = ILLEGAL
+            continue
+        black_king = squares[-1]
+        occupancy = 0
+        for square in squares:
+            occupancy |= 1 << square
+        white_occupancy = occupancy ^ (1 << black_king)
+        # The black king does not block attacks on the squares behind it
+        attacked = _white_attacks(pieces, squares[:-1], white_occupancy)
+        if attacked >> black_king & 1:
+            values[white_index] = ILLEGAL  # White to move with Black in check
+
+        escapes = 0
+        for target in iter_squares(KING_ATTACKS[black_king] & ~attacked):
+            if white_occupancy >> target & 1:
+                moves_left[black_index] = ILLEGAL  # An undefended piece can be taken
+                break
+            escapes += 1
+        else:
+            moves_left[black_index] = escapes
+            if not escapes and attacked >> black_king & 1:
+                layers.setdefault(1, []).append(black_index)
+
+        if promotion_tables and values[white_index] != ILLEGAL:
+            _seed_promotions(pieces, squares, occupancy, white_index, promotion_tables, layers)
+
+    distance = 1
+    decided = longest = 0
+    while layers:
+        layer = layers.pop(distance, [])
+        for index in layer:
+            if values[index]:
+                continue
+            values[index] = distance
+            decided += 1
+            longest = distance - 1
+            squares = _squares(index % half, count + 1)
+            if index >= half:
+                _unmove_white(pieces, squares, values, layers, distance + 1)
+            else:
+                _unmove_black(pieces, squares, values, moves_left, layers, distance + 1, half)
+        distance += 1
+
+    # Keep the positions with the white king in the stored part of the board
+    _, slots = SYMMETRIES['P' in name]
+    block = 64 ** count
+    path = os.path.join(directory, name + '.tb')
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as table_file:
+        for black_to_move in (0, 1):
+            for king in slots:
+                offset = (black_to_move * 64 + king) * block
+                table_file.write(values[offset:offset + block])
+    os.replace(path + '.tmp', path)
+    log(f"{name}: {decided} decided positions, longest mate {longest} plies, "
+        f"{time.perf_counter() - start:.1f}s")
+    return path
+
+
+def _squares(index, count):
+    squares = []
+    for _ in range(count):
+        index, square = divmod(index, 64)
+        squares.append(square)
+    return squares[::-1]
+
+
+def _seed_promotions(pieces, squares, occupancy, white_index, promotion_tables, layers):
+    """Queue a White pawn position whose promotion wins in another table."""
+    pawn_slot = pieces.index('P')
+    pawn = squares[pawn_slot]
+    if pawn >= 16 or occupancy >> (pawn - 8) & 1:
+        return
+    best = None
+    for letter, table in promotion_tables.items():
+        promoted = list(squares)
+        promoted[pawn_slot] = pawn - 8
+        # Promotion tables list the new piece right after the king
+        order = [promoted[0], promoted[pawn_slot]] + \
+            [square for slot, square in enumerate(promoted[1:-1], 1) if slot != pawn_slot] + [promoted[-1]]
+        value = table[_stored_index(PROMOTION_TABLES[letter], 1, order)]
+        if value not in (DRAW, ILLEGAL) and (best is None or value < best):
+            best = value
+    if best is not None:
+        layers.setdefault(best + 1, []).append(white_index)
+
+
+def _unmove_white(pieces, squares, values, layers, distance):
+    """Queue every White position with a move to this lost Black position."""
+    black_king = squares[-1]
+    occupancy = 0
+    for square in squares:
+        occupancy |= 1 << square
+    for slot, name in enumerate(pieces):
+        square = squares[slot]
+        if name == 'P':
+            origins = []
+            if not occupancy >> (square + 8) & 1 and square + 8 < 56:
+                origins.append(square + 8)
+                if 32 <= square < 40 and not occupancy >> (square + 16) & 1:
+                    origins.append(square + 16)
+        else:
+            reach = piece_attacks(name, square, occupancy) & ~occupancy
+            if name == 'K':
+                reach &= ~KING_ATTACKS[black_king]
+            origins = iter_squares(reach)
+        for origin in origins:
+            before = list(squares)
+            before[slot] = origin
+            index = _index(0, before)
+            if not values[index]:
+                layers.setdefault(distance, []).append(index)
+
+
+def _unmove_black(pieces, squares, values, moves_left, layers, distance, half):
+    """Count this won White position against every Black position that can move into it."""
+    black_king = squares[-1]
+    occupancy = 0
+    for square in squares:
+        occupancy |= 1 << square
+    for origin in iter_squares(KING_ATTACKS[black_king] & ~occupancy & ~KING_ATTACKS[squares[0]]):
+        before = list(squares)
+        before[-1] = origin
+        index = _index(1, before)
+        if values[index] or moves_left[index] == ILLEGAL:
+            continue
+        moves_left[index] -= 1
+        if not moves_left[index]:
+            layers.setdefault(distance, []).append(index)
+
+
+class Tablebases:
+    """Probes the tables found in a directory, mapping each file on first use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}
+
+    def _table(self, name):
+        if name not in self._tables:
+            path = os.path.join(self.directory, name + '.tb')
+            table = None
+            if os.path.exists(path) and os.path.getsize(path) == table_size(name):
+                with open(path, 'rb') as table_file:
+                    table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._tables[name] = table
+        return self._tables[name]
+
+    def probe(self, board):
+        """Return ('win' | 'loss' | 'draw', plies to mate) for the side to move, or None.
+
+        Bare kings and other endings without mating material are draws.
+        Positions with castling rights are not covered.
+        """
+        if board.insufficient_material():
+            return 'draw', 0
+        if board.castling:
+            return None
+        white, black = [], []
+        for square, letter in enumerate(board.position.squares):
+            if letter is not None and letter not in 'Kk':
+                (white if letter.isupper() else black).append((letter.upper(), square))
+        if white and black:
+            return None
+        flip = bool(black)
+        strong = sorted(black or white, key=lambda item: PIECE_ORDER.index(item[0]))
+        name = 'K' + ''.join(letter for letter, _ in strong) + 'K'
+        if name not in SUPPORTED:
+            return None
+        table = self._table(name)
+        if table is None:
+            return None
+
+        strong_king = board.position.king_square('b' if flip else 'w')
+        weak_king = board.position.king_square('w' if flip else 'b')
+        squares = [strong_king] + [square for _, square in strong] + [weak_king]
+        if flip:
+            squares = [square ^ 56 for square in squares]  # Mirror the ranks
+        strong_to_move = (board.turn == 'b') == flip
+        value = table[_stored_index(name, 0 if strong_to_move else 1, squares)]
+        if value == DRAW:
+            return 'draw', 0
+        if value == ILLEGAL:
+            return None
+        return ('win' if strong_to_move else 'loss'), value - 1
+
+    def best_move(self, board):
+        """Return (move, result, plies) of the best tablebase move, or None if not covered.
+
+        Wins take the shortest mate, losses the longest defence.
+        """
+        if self.probe(board) is None:
+            return None
+        best = None
+        for move in board.generate_legal_moves():
+            board.make_move(*move)
+            answer = self.probe(board)
+            board.unmake_move()
+            if answer is None:
+                continue
+            result, plies = answer
+            # The child is from the opponent's point of view
+            mine = {'win': 'loss', 'loss': 'win', 'draw': 'draw'}[result]
+            rank = {'win': (2, -plies), 'draw': (1, 0), 'loss': (0, plies)}[mine]
+            if best is None or rank > best[0]:
+                best = (rank, move, mine, plies + 1 if mine != 'draw' else 0)
+        return best[1:] if best else None
+
+    def close(self):
+        for table in self._tables.values():
+            if table is not None:
+                table.close()
+        self._tables = {}
+
+
+def describe(result, plies):
+    """Turn a probe result into text such as 'mate in 7' or 'draw'."""
+    if result == 'draw':
+        return 'draw'
+    moves = (plies + 1) // 2
+    return f"mate in {moves}" if result == 'win' else f"mated in {moves}"
+
+
+def _generate_job(name, directory):
+    lines = []
+    generate(name, directory, log=lines.append)
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('generate', help="build tables")
+    build.add_argument('sets', nargs='*', default=['KQK', 'KRK', 'KBK', 'KNK', 'KPK'],
+                       help=f"material sets, from: {' '.join(SUPPORTED)}")
+    build.add_argument('--dir', default='tablebases', help="directory for the table files")
+    build.add_argument('--workers', type=int, help="tables generated at once (default: one per CPU)")
+    probe = commands.add_parser('probe', help="look up a position")
+    probe.add_argument('--fen', required=True, help="position to look up")
+    probe.add_argument('--dir', default='tablebases', help="directory with the table files")
+    args = parser.parse_args(argv)
+
+    if args.command == 'probe':
+        tablebases = Tablebases(args.dir)
+        board = Board(args.fen)
+        answer = tablebases.best_move(board)
+        if answer is None:
+            print("Position not covered.")
+            return 1
+        move, result, plies = answer
+        print(f"{describe(result, plies)}, best move {move_to_uci(move)}")
+        return 0
+
+    for name in args.sets:
+        if name not in SUPPORTED:
+            parser.error(f"unsupported material set: {name}")
+    # Pawn tables read the tables their promotions lead to, so they come second
+    waves = [[name for name in args.sets if 'P' not in name], [name for name in args.sets if 'P' in name]]
+    with ProcessPoolExecutor(args.workers or os.cpu_count() or 1) as pool:
+        for wave in waves:
+            for lines in pool.map(_generate_job, wave, [args.dir] * len(wave)):
+                print('\n'.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""Self-play tournaments between two engine settings, played in parallel.
+
+Every opening is played twice with colours swapped. Openings come from a
+file of FEN/EPD lines or from a few random moves out of the start position.
+Games end on mate, stalemate, repetition, the fifty-move rule or bare
+material, or are adjudicated: a draw after --max-plies, a win once both
+engines agree on a decisive score for several moves, and the tablebase
+result as soon as a position is in the tables given with --tablebases.
+
+    python tournament.py --games 100 --a depth=4 --b depth=3 --pgn games.pgn
+    python tournament.py --a nodes=20000 --b nodes=10000 --sprt 0 10
+
+An engine setting is a comma-separated list of depth=, nodes=, movetime=
+(seconds) and hash= (MB). With --sprt ELO0 ELO1 the match stops as soon as
+the sequential probability ratio test accepts either hypothesis.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from chess_core import START_FEN, Board
+from engine import Engine
+from pgn import format_game
+from tablebase import Tablebases
+
+ENGINE_OPTIONS = {'depth': int, 'nodes': int, 'movetime': float, 'hash': int}
+
+_engines = {}  # Engines of the current worker process, by setting
+_tablebases = {}  # Tablebases of the current worker process, by directory
+
+
+def parse_engine(spec):
+    """Turn 'depth=4,nodes=20000' into a dict of engine options."""
+    options = {'depth': 64 if 'nodes' in spec or 'movetime' in spec else 4, 'hash': 16}
+    for item in filter(None, spec.split(',')):
+        name, _, value = item.partition('=')
+        if name not in ENGINE_OPTIONS:
+            raise ValueError(f"Unknown engine option: {name}")
+        options[name] = ENGINE_OPTIONS[name](value)
+    return options
+
+
+def random_opening(rng, plies):
+    """Return the moves of a random, still playable opening of `plies` moves."""
+    while True:
+        board = Board()
+        moves = []
+        for _ in range(plies):
+            legal = board.generate_legal_moves()
+            if not legal:
+                break
+            move = rng.choice(legal)
+            board.make_move(*move)
+            moves.append(move)
+        if board.generate_legal_moves():
+            return moves
+
+
+def _engine(spec):
+    engine = _engines.get(spec)
+    if engine is None:
+        options = parse_engine(spec)
+        engine = _engines[spec] = Engine(max_depth=options['depth'], max_nodes=options.get('nodes'),
+                                         max_time=options.get('movetime'), hash_mb=options['hash'])
+    return engine
+
+
+def play_game(fen, opening, white, black, max_plies=400, resign_score=1000, resign_moves=4, tablebase_dir=None):
+    """Play one game between two engine settings and return a dict describing it.
+
+    `result` is from White's point of view; `nodes` and `seconds` are per
+    colour, `moves` the full move list including the opening.
+    """
+    board = Board(fen)
+    for move in opening:
+        board.make_move(*move)
+    engines = {'w': _engine(white), 'b': _engine(black)}
+    for engine in engines.values():
+        engine.table.clear()
+    nodes = {'w': 0, 'b': 0}
+    seconds = {'w': 0.0, 'b': 0.0}
+    searched = {'w': 0, 'b': 0}
+    moves = list(opening)
+    decisive = 0  # Consecutive moves on which both sides saw the same side winning
+    last_score = None
+    tablebases = None
+    if tablebase_dir:
+        tablebases = _tablebases.setdefault(tablebase_dir, Tablebases(tablebase_dir))
+
+    while True:
+        status = board.game_status()
+        if status == 'checkmate':
+            result, reason = ('0-1' if board.turn == 'w' else '1-0'), 'checkmate'
+            break
+        if status == 'stalemate':
+            result, reason = '1/2-1/2', 'stalemate'
+            break
+        if board.repetition_count() >= 2:
+            result, reason = '1/2-1/2', 'repetition'
+            break
+        if board.halfmove_clock >= 100:
+            result, reason = '1/2-1/2', 'fifty moves'
+            break
+        if board.insufficient_material():
+            result, reason = '1/2-1/2', 'insufficient material'
+            break
+        if len(moves) - len(opening) >= max_plies:
+            result, reason = '1/2-1/2', 'adjudicated: move limit'
+            break
+        known = tablebases.probe(board) if tablebases else None
+        if known:
+            winner = board.turn if known[0] == 'win' else ('b' if board.turn == 'w' else 'w')
+            result = '1/2-1/2' if known[0] == 'draw' else ('1-0' if winner == 'w' else '0-1')
+            reason = 'adjudicated: tablebase'
+            break
+
+        color = board.turn
+        search = engines[color].search(board)
+        nodes[color] += search.nodes
+        seconds[color] += search.seconds
+        searched[color] += 1
+        # Scores are from the side to move; turn them into White's view
+        score = search.score if color == 'w' else -search.score
+        if last_score is not None and abs(score) >= resign_score and abs(last_score) >= resign_score \
+                and (score > 0) == (last_score > 0):
+            decisive += 1
+        else:
+            decisive = 0
+        last_score = score
+        if decisive >= resign_moves:
+            result, reason = ('1-0' if score > 0 else '0-1'), 'adjudicated: decisive score'
+            break
+        board.make_move(*search.move)
+        moves.append(search.move)
+
+    return {'result': result, 'reason': reason, 'moves': moves, 'nodes': nodes,
+            'seconds': seconds, 'searched': searched}
+
+
+def _play_pair_game(game_id, fen, opening, engine_a, engine_b, limits):
+    a_is_white = game_id % 2 == 0
+    white, black = (engine_a, engine_b) if a_is_white else (engine_b, engine_a)
+    game = play_game(fen, opening, white, black, *limits)
+    game['id'] = game_id
+    game['fen'] = fen
+    game['a_is_white'] = a_is_white
+    return game
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """Log-likelihood ratio of elo1 against elo0 for a W/D/L record (normal approximation)."""
+    games = wins + draws + losses
+    if not games or not wins + losses:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score * score
+    if variance <= 0:
+        return 0.0
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games if games else 0.5
+    if score <= 0 or score >= 1:
+        return math.copysign(math.inf, score - 0.5)
+    return -400 * math.log10(1 / score - 1) + 0.0  # + 0.0 turns -0.0 into 0.0
+
+
+def openings_from_file(path):
+    """Read starting positions, one FEN or EPD per line."""
+    with open(path, encoding='utf-8') as openings_file:
+        fens = []
+        for line in openings_file:
+            fields = line.split()
+            if fields and not line.startswith('#'):
+                fens.append(' '.join(fields[:6] if len(fields) >= 6 and fields[4].isdigit() else fields[:4]))
+    if not fens:
+        raise ValueError(f"No positions in {path}")
+    return fens
+
+
+def schedule(games, openings, random_plies, seed):
+    """Yield (game_id, fen, opening_moves); each opening is used for two games in a row."""
+    rng = random.Random(seed)
+    for game_id in range(games):
+        if game_id % 2 == 0:
+            if openings:
+                fen, opening = openings[(game_id // 2) % len(openings)], []
+            else:
+                fen, opening = START_FEN, random_opening(rng, random_plies)
+        yield game_id, fen, opening
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine settings against each other.")
+    parser.add_argument('--a', default='depth=4', help="settings of engine A (e.g. depth=4,hash=16)")
+    parser.add_argument('--b', default='depth=3', help="settings of engine B")
+    parser.add_argument('--games', type=int, default=20, help="number of games (rounded up to pairs)")
+    parser.add_argument('--workers', type=int, help="games played at once (default: one per CPU)")
+    parser.add_argument('--openings', help="file of starting positions, one FEN/EPD per line")
+    parser.add_argument('--random-plies', type=int, default=4, help="random opening moves without --openings")
+    parser.add_argument('--seed', type=int, default=1, help="seed for the random openings")
+    parser.add_argument('--max-plies', type=int, default=400, help="plies after the opening before a draw")
+    parser.add_argument('--resign-score', type=int, default=1000, help="centipawns for a win adjudication")
+    parser.add_argument('--resign-moves', type=int, default=4, help="moves the score must hold")
+    parser.add_argument('--tablebases', help="directory of tablebase.py tables to adjudicate endings")
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'), help="stop early with an SPRT")
+    parser.add_argument('--alpha', type=float, default=0.05, help="SPRT false positive rate")
+    parser.add_argument('--beta', type=float, default=0.05, help="SPRT false negative rate")
+    parser.add_argument('--pgn', help="write the games to this PGN file")
+    args = parser.parse_args(argv)
+    for spec in (args.a, args.b):
+        try:
+            parse_engine(spec)
+        except ValueError as error:
+            parser.error(str(error))
+
+    games = args.games + args.games % 2
+    openings = openings_from_file(args.openings) if args.openings else None
+    limits = (args.max_plies, args.resign_score, args.resign_moves, args.tablebases)
+    workers = args.workers or os.cpu_count() or 1
+    lower = math.log(args.beta / (1 - args.alpha))
+    upper = math.log((1 - args.beta) / args.alpha)
+
+    wins = draws = losses = 0
+    totals = {'A': [0, 0.0, 0], 'B': [0, 0.0, 0]}  # nodes, seconds, moves searched
+    verdict = None
+    pgn_file = open(args.pgn, 'w', encoding='utf-8') if args.pgn else None
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque()
+            jobs = schedule(games, openings, args.random_plies, args.seed)
+            while True:
+                while len(pending) < 2 * workers:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.append(pool.submit(_play_pair_game, *job, args.a, args.b, limits))
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    game = future.result()
+                    a_color, b_color = ('w', 'b') if game['a_is_white'] else ('b', 'w')
+                    for name, color in (('A', a_color), ('B', b_color)):
+                        totals[name][0] += game['nodes'][color]
+                        totals[name][1] += game['seconds'][color]
+                        totals[name][2] += game['searched'][color]
+                    if game['result'] == '1/2-1/2':
+                        draws += 1
+                    elif (game['result'] == '1-0') == game['a_is_white']:
+                        wins += 1
+                    else:
+                        losses += 1
+                    played = wins + draws + losses
+                    print(f"game {game['id'] + 1}: {game['result']} ({game['reason']}), "
+                          f"A {wins}-{draws}-{losses} after {played}")
+
+                    if pgn_file:
+                        headers = {'Event': 'Self-play', 'Round': str(game['id'] + 1),
+                                   'White': args.a if game['a_is_white'] else args.b,
+                                   'Black': args.b if game['a_is_white'] else args.a,
+                                   'Termination': game['reason']}
+                        pgn_file.write(format_game(game['moves'], headers, game['fen'], game['result']))
+
+                    if args.sprt and verdict is None:
+                        llr = sprt_llr(wins, draws, losses, *args.sprt)
+                        if llr >= upper or llr <= lower:
+                            verdict = f"SPRT: {'H1' if llr >= upper else 'H0'} accepted (LLR {llr:.2f})"
+                if verdict:
+                    for future in pending:
+                        future.cancel()
+                    break
+    finally:
+        if pgn_file:
+            pgn_file.close()
+
+    played = wins + draws + losses
+    print()
+    print(f"{played} games in {time.perf_counter() - start:.1f}s: A {args.a!r} vs B {args.b!r}")
+    print(f"A: {wins} wins, {draws} draws, {losses} losses "
+          f"({(wins + draws / 2) / played:.1%}, Elo {elo_difference(wins, draws, losses):+.0f})")
+    for name, (nodes, seconds, searched) in totals.items():
+        nps = nodes / seconds if seconds else 0
+        per_move = seconds / searched if searched else 0
+        print(f"{name}: {nps:,.0f} nodes/s, {per_move * 1000:.0f} ms/move")
+    if args.sprt:
+        print(verdict or f"SPRT: no decision (LLR {sprt_llr(wins, draws, losses, *args.sprt):.2f}, "
+                         f"bounds {lower:.2f} {upper:.2f})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Fixed-size transposition table keyed by Board.zobrist_key().
+
+Entries live in one preallocated buffer, so memory use is set once by the
+configured size and never grows. The buffer can be shared memory, letting
+several search processes use one table. Each entry is two 64-bit words:
+the packed data (score, best move packed with chess_core.encode_move,
+depth, bound and search generation) and the key xored with that data. A probe only accepts
+an entry whose words xor back to its key, so entries torn by concurrent
+writers without locks are rejected instead of misread.
+"""
+EXACT, LOWER, UPPER = 0, 1, 2
+ENTRY_BYTES = 16
+_GENERATIONS = 64
+
+
+def table_entries(size_mb):
+    """Number of entries a table of `size_mb` megabytes holds (a power of two)."""
+    entries = max(1, size_mb * 1024 * 1024 // ENTRY_BYTES)
+    return 1 << (entries.bit_length() - 1)
+
+
+class TranspositionTable:
+    """Single-slot hash table with a depth-preferred, age-aware replacement policy.
+
+    A new entry replaces the one in its slot when it is for the same
+    position, when the stored entry was written by an earlier search, or
+    when it was searched at least as deep.
+
+    `buffer`, if given, must be a writable buffer of at least
+    table_entries(size_mb) * ENTRY_BYTES bytes, e.g. SharedMemory.buf.
+    """
+
+    def __init__(self, size_mb=16, buffer=None):
+        self.size = table_entries(size_mb)
+        self.size_mb = size_mb
+        self.nbytes = self.size * ENTRY_BYTES
+        self._mask = self.size - 1
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self._raw = memoryview(buffer if buffer is not None else bytearray(self.nbytes))[:self.nbytes]
+        half = self.nbytes // 2
+        self._checks = self._raw[:half].cast('Q')
+        self._data = self._raw[half:].cast('Q')
+
+    def clear(self):
+        self._raw[:] = bytes(self.nbytes)
+
+    def release(self):
+        """Drop the views on the buffer so shared memory can be closed."""
+        self._checks.release()
+        self._data.release()
+        self._raw.release()
+
+    def new_search(self):
+        """Age the table so entries from earlier searches are replaced first."""
+        self.generation = (self.generation + 1) % _GENERATIONS
+
+    def probe(self, key):
+        """Return (depth, bound, score, move_code) for `key`, or None if it is not stored."""
+        self.probes += 1
+        slot = key & self._mask
+        data = self._data[slot]
+        if not data or self._checks[slot] ^ data != key:
+            return None
+        self.hits += 1
+        score = data & 0xFFFFFFFF
+        if score >= 1 << 31:
+            score -= 1 << 32
+        meta = data >> 48
+        return (meta & 0xFF) - 1, (meta >> 8) & 3, score, (data >> 32) & 0xFFFF
+
+    def store(self, key, depth, bound, score, move_code=0):
+        slot = key & self._mask
+        old = self._data[slot]
+        if old:
+            same_position = self._checks[slot] ^ old == key
+            meta = old >> 48
+            if not same_position and (meta >> 10) == self.generation and (meta & 0xFF) - 1 > depth:
+                return
+            if same_position and not move_code:
+                move_code = (old >> 32) & 0xFFFF  # Keep the known best move
+        # Depth is stored off by one so that all-zero data means "empty"
+        meta = (min(depth, 0xFE) + 1) | (bound << 8) | (self.generation << 10)
+        data = (score & 0xFFFFFFFF) | (move_code << 32) | (meta << 48)
+        self._data[slot] = data
+        self._checks[slot] = key ^ data
+
+    def usage(self):
+        """Return the fraction of slots written during the current search generation."""
+        sample = min(self.size, 1000)
+        data = self._data
+        used = sum(1 for slot in range(sample) if data[slot] and (data[slot] >> 58) == self.generation)
+        return used / sample
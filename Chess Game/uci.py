@@ -0,0 +1,239 @@
+"""UCI front-end: lets GUIs and tournament managers drive the built-in engine.
+
+    python uci.py
+
+Supported commands: uci, isready, setoption (Hash, Ponder), ucinewgame,
+position [startpos | fen <fen>] [moves ...], go (depth, nodes, movetime,
+wtime/btime/winc/binc/movestogo, infinite, ponder), stop, ponderhit and
+quit. Searches run on a background thread and stream an info line, with
+the hashfull of the transposition table, for every completed depth, so
+stop and isready are answered while searching.
+
+GUIs resend the whole game with every position command. When the new move
+list extends (or takes back moves from) the previous one, only the
+difference is played on the current board, so a long game costs a couple
+of moves per command rather than a replay from the start.
+"""
+import sys
+import threading
+
+from chess_core import START_FEN, Board, move_to_uci, parse_uci
+from engine import MATE_SCORE, MAX_PLY, Engine, is_mate_score
+
+ENGINE_NAME = 'Chess Game'
+DEFAULT_HASH_MB = 16
+MOVE_OVERHEAD = 0.05  # Seconds kept back from every timed move for the GUI round trip
+GO_LIMITS = {'depth': int, 'nodes': int, 'movetime': int, 'wtime': int, 'btime': int,
+             'winc': int, 'binc': int, 'movestogo': int, 'mate': int}
+
+
+def parse_go(tokens):
+    """Turn the words after 'go' into a dict of limits; 'infinite' and 'ponder' map to True."""
+    limits = {}
+    index = 0
+    while index < len(tokens):
+        name = tokens[index]
+        if name in ('infinite', 'ponder'):
+            limits[name] = True
+        elif name in GO_LIMITS and index + 1 < len(tokens):
+            limits[name] = GO_LIMITS[name](tokens[index + 1])
+            index += 1
+        index += 1
+    return limits
+
+
+def time_budget(limits, turn):
+    """Return the seconds to spend on a move under `limits`, or None for no time limit."""
+    if 'movetime' in limits:
+        return max(0.001, limits['movetime'] / 1000 - MOVE_OVERHEAD)
+    remaining = limits.get('wtime' if turn == 'w' else 'btime')
+    if remaining is None:
+        return None
+    increment = limits.get('winc' if turn == 'w' else 'binc', 0)
+    budget = remaining / limits.get('movestogo', 30) + increment * 0.8
+    return max(0.001, min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD)
+
+
+def format_info(result, hashfull=None):
+    """Return the UCI info line for a SearchResult; `hashfull` is the table usage from 0 to 1."""
+    if is_mate_score(result.score):
+        moves = (MATE_SCORE - abs(result.score) + 1) // 2
+        score = f"mate {moves if result.score > 0 else -moves}"
+    else:
+        score = f"cp {result.score}"
+    milliseconds = int(result.seconds * 1000)
+    nps = int(result.nodes / result.seconds) if result.seconds else 0
+    pv = ' '.join(move_to_uci(move) for move in result.pv)
+    table = f"hashfull {int(hashfull * 1000)} " if hashfull is not None else ''
+    return (f"info depth {result.depth} score {score} nodes {result.nodes} nps {nps} "
+            f"time {milliseconds} {table}pv {pv}")
+
+
+class UCIEngine:
+    """Keeps the protocol state: the current board, the engine and the running search."""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.engine = Engine(max_depth=MAX_PLY - 1, hash_mb=DEFAULT_HASH_MB)
+        self.board = Board()
+        self._base = START_FEN
+        self._moves = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+        self._release = None  # Set once a ponder or infinite search may report its move
+        self._ponder_budget = None
+
+    def send(self, line):
+        with self._lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def handle(self, line):
+        """Process one command line; return False after 'quit'."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send("id author Chess Game contributors")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 1024")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.set_option(arguments)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.engine.table.clear()
+        elif command == 'position':
+            self.stop()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop()
+            self.go(parse_go(arguments))
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, arguments):
+        text = ' '.join(arguments)
+        name, _, value = text.partition(' value ')
+        name = name.replace('name', '', 1).strip().lower()
+        if name == 'hash':
+            self.stop()
+            self.engine = Engine(max_depth=MAX_PLY - 1, hash_mb=max(1, int(value)))
+
+    def set_position(self, arguments):
+        """Apply 'position [startpos | fen <fen>] [moves ...]' to the board."""
+        if 'moves' in arguments:
+            split = arguments.index('moves')
+            setup, moves = arguments[:split], arguments[split + 1:]
+        else:
+            setup, moves = arguments, []
+        if setup[:1] == ['fen']:
+            base = ' '.join(setup[1:])
+        else:
+            base = START_FEN
+
+        common = 0
+        if base == self._base:
+            limit = min(len(moves), len(self._moves))
+            while common < limit and moves[common] == self._moves[common]:
+                common += 1
+            for _ in range(len(self._moves) - common):
+                self.board.unmake_move()
+        else:
+            try:
+                board = Board(base)
+            except ValueError as error:
+                self.send(f"info string {error}")
+                return
+            self.board, self._base = board, base
+        del self._moves[common:]
+
+        for text in moves[common:]:
+            try:
+                move = parse_uci(text)
+            except ValueError:
+                self.send(f"info string invalid move {text}")
+                break
+            if move not in self.board.generate_legal_moves():
+                self.send(f"info string illegal move {text}")
+                break
+            self.board.make_move(*move)
+            self._moves.append(text)
+
+    def go(self, limits):
+        max_depth = limits.get('depth')
+        if 'mate' in limits:
+            max_depth = 2 * limits['mate'] - 1
+        max_time = time_budget(limits, self.board.turn)
+        waits = limits.get('infinite') or limits.get('ponder')
+        self._ponder_budget = max_time if limits.get('ponder') else None
+        if waits:
+            max_time = None  # Pondering and infinite searches run until stop or ponderhit
+
+        self._stop = threading.Event()
+        self._release = threading.Event()
+        if not waits:
+            self._release.set()
+        self._thread = threading.Thread(
+            target=self._search, name='uci-search', daemon=True,
+            args=(self.board.copy(), max_depth, limits.get('nodes'), max_time, self._stop, self._release))
+        self._thread.start()
+
+    def _search(self, board, max_depth, max_nodes, max_time, stop, release):
+        table = self.engine.table
+        result = self.engine.search(board, max_depth, max_nodes, max_time,
+                                    info=lambda result: self.send(format_info(result, table.usage())), stop=stop)
+        # Pondering and infinite searches may only answer once told to
+        release.wait()
+        if result.move is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send(f"bestmove {move_to_uci(result.move)} ponder {move_to_uci(result.pv[1])}")
+        else:
+            self.send(f"bestmove {move_to_uci(result.move)}")
+
+    def ponderhit(self):
+        """The predicted move was played: keep searching, now against the clock."""
+        if self._thread is None:
+            return
+        if self._ponder_budget is not None:
+            timer = threading.Timer(self._ponder_budget, self._stop.set)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._stop.set()
+        self._release.set()
+
+    def stop(self):
+        """End the running search, if any, and wait for its bestmove."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._release.set()
+        self._thread.join()
+        self._thread = None
+
+
+def main():
+    uci = UCIEngine()
+    for line in sys.stdin:
+        if not uci.handle(line):
+            break
+    else:
+        uci.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())